@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+#
+# End to end benchmark of the download paths against the local stand-in
+# server. Every run downloads a whole course in a fresh interpreter, through
+# the library API, and reports the wall time, throughput, peak RSS and the
+# time of every lecture.
+#
+#   python benchmarks/harness.py [--paths mediasite-raw ...] [--runs 3]
+#                                [--option engine=thread ...] [--latency 0.05]
+#
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from os import walk
+from os.path import abspath, dirname, getsize, join
+
+import mockserver
+
+SRC = join(dirname(abspath(__file__)), "..", "src", "bsms")
+# Platform and course path of every download path.
+PATHS = {
+    "mediasite-segmented": ("mediasite",
+                            "/Mediasite/Catalog/catalogs/segmented"),
+    "mediasite-raw": ("mediasite", "/Mediasite/Catalog/catalogs/raw"),
+    "mediasite-slides": ("mediasite", "/Mediasite/Catalog/catalogs/slides"),
+    "brightspace-hls": ("brightspace", "/d2l/home/1234"),
+}
+
+
+def run_child(platform, url, output, options, result_fname):
+    # Runs in the fresh interpreter.
+    import resource
+    sys.path.insert(0, SRC)
+    from downloader import Downloader, get_platform
+
+    module = get_platform(platform)
+    download_lecture = module.download_lecture
+    lecture_times = []
+
+    def timed_lecture(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return download_lecture(*args, **kwargs)
+        finally:
+            lecture_times.append(time.perf_counter() - start)
+
+    module.download_lecture = timed_lecture
+    start = time.perf_counter()
+    with Downloader(**options) as downloader:
+        ok = downloader.download_course(platform, url, output)
+    wall = time.perf_counter() - start
+    with open(result_fname, "w") as f:
+        json.dump({"ok": bool(ok), "wall": wall, "lectures": lecture_times,
+                   "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss},
+                  f)
+
+
+def output_size(path):
+    return sum(getsize(join(root, name))
+               for root, _, names in walk(path) for name in names)
+
+
+def run_once(path, base, options, verbose):
+    platform, course = PATHS[path]
+    workdir = tempfile.mkdtemp(prefix="bsms-bench-")
+    try:
+        output = join(workdir, "out")
+        result_fname = join(workdir, "result.json")
+        subprocess.run([sys.executable, abspath(__file__), "--child",
+                        json.dumps([platform, base + course, output, options,
+                                    result_fname])],
+                       check=True, stdout=None if verbose else
+                       subprocess.DEVNULL)
+        with open(result_fname) as f:
+            result = json.load(f)
+        result["bytes"] = output_size(output)
+        return result
+    finally:
+        shutil.rmtree(workdir)
+
+
+def percentile(values, fraction):
+    # Nearest rank.
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(int(len(values) * fraction + 0.5)
+                                           - 1, 0))]
+
+
+def summarize(runs):
+    walls = [run["wall"] for run in runs]
+    lectures = [seconds for run in runs for seconds in run["lectures"]]
+    return {
+        "runs": len(runs),
+        "failed": sum(1 for run in runs if not run["ok"]),
+        "wall": percentile(walls, 0.5),
+        "throughput": sum(run["bytes"] for run in runs) / max(sum(walls),
+                                                             1e-9),
+        "rss": max(run["rss"] for run in runs) * 1024,
+        "lecture_p50": percentile(lectures, 0.5),
+        "lecture_p99": percentile(lectures, 0.99),
+    }
+
+
+def parse_option(value):
+    # KEY=VALUE, the value is JSON if it parses as such.
+    key, _, value = value.partition("=")
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return key.replace("-", "_"), value
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        run_child(*json.loads(sys.argv[2]))
+        return 0
+    parser = argparse.ArgumentParser("harness.py",
+                                     description="Download path benchmarks against the local stand-in server.")
+    parser.add_argument("--paths", nargs="+", choices=sorted(PATHS),
+                        default=sorted(PATHS),
+                        help="Download paths to benchmark.")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="Number of course downloads per path.")
+    parser.add_argument("--option", dest="options", action="append",
+                        type=parse_option, default=[], metavar="KEY=VALUE",
+                        help="Downloader option, like engine=thread or jobs=4.")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON.")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Show the output of the downloads.")
+    mockserver.add_options(parser)
+    args = parser.parse_args()
+
+    options = dict(args.options)
+    server = mockserver.MockServer(mockserver.options_from(args)).start()
+    results = {}
+    try:
+        for path in args.paths:
+            runs = [run_once(path, server.url, options, args.verbose)
+                    for _ in range(args.runs)]
+            results[path] = summarize(runs)
+    finally:
+        server.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    print("{:20} {:>6} {:>9} {:>10} {:>9} {:>10} {:>10}".format(
+            "path", "failed", "wall s", "MiB/s", "RSS MiB", "p50 s",
+            "p99 s"))
+    for path, result in results.items():
+        print("{:20} {:>6} {:9.2f} {:10.1f} {:9.1f} {:10.2f} {:10.2f}".format(
+                path, result["failed"], result["wall"],
+                result["throughput"] / 2 ** 20, result["rss"] / 2 ** 20,
+                result["lecture_p50"], result["lecture_p99"]))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
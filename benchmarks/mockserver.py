@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+#
+# A local stand-in for Mediasite and Brightspace, for benchmarks and offline
+# runs. It serves the pages and JSON endpoints the scrapers use, synthetic HLS
+# playlists with fragmented MP4 or TS segments, raw MP4 with Range support and
+# slide images. Faults can be injected into the media requests: latency,
+# jitter, a bandwidth cap per response, throttling, errors and truncated
+# bodies.
+#
+#   python benchmarks/mockserver.py [--port 8080] [--latency 0.05] ...
+#
+# Mediasite courses are at /Mediasite/Catalog/catalogs/<kind>, where kind is
+# one of segmented, raw or slides and picks the stream of all its lectures.
+# The Brightspace course is at /d2l/home/<course id>.
+
+import argparse
+import json
+import random
+import re
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import urlparse, parse_qs
+
+import pages
+
+MEDIASITE_KINDS = ("segmented", "raw", "slides")
+# The catalog ids of the Mediasite courses, one per kind of stream.
+CATALOGS = {
+    "segmented": "5e9a1c1e-0000-4000-8000-000000000001",
+    "raw": "5e9a1c1e-0000-4000-8000-000000000002",
+    "slides": "5e9a1c1e-0000-4000-8000-000000000003",
+}
+SERVICE_PATH = "/Mediasite/PlayerService/PlayerService.svc/json"
+SEGMENT_DURATION = 4.0
+WRITE_CHUNK = 64 * 1024
+TS_PACKET = 188
+
+
+def box(kind, *parts):
+    body = b"".join(parts)
+    return struct.pack(">I4s", 8 + len(body), kind) + body
+
+
+def full_box(kind, version, flags, *parts):
+    return box(kind, struct.pack(">I", version << 24 | flags), *parts)
+
+
+def init_segment(track_id, handler, timescale, duration):
+    # Just the boxes the remuxer reads, players would want a sample table.
+    matrix = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0,
+                         0x40000000)
+    mvhd = full_box(b"mvhd", 0, 0,
+                    struct.pack(">IIIIIH10x", 0, 0, timescale, duration,
+                                0x10000, 0x100),
+                    matrix, bytes(24), struct.pack(">I", track_id + 1))
+    tkhd = full_box(b"tkhd", 0, 3,
+                    struct.pack(">IIIIIIIHHHH", 0, 0, track_id, 0, duration,
+                                0, 0, 0, 0, 0x100 if handler == b"soun" else 0,
+                                0),
+                    matrix, struct.pack(">II", 1280 << 16, 720 << 16))
+    mdhd = full_box(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, timescale,
+                                               duration, 0x55c4, 0))
+    hdlr = full_box(b"hdlr", 0, 0, struct.pack(">I4s12x", 0, handler),
+                    b"\0")
+    trak = box(b"trak", tkhd, box(b"mdia", mdhd, hdlr))
+    mvex = box(b"mvex", full_box(b"mehd", 0, 0, struct.pack(">I", duration)),
+               full_box(b"trex", 0, 0, struct.pack(">IIIII", track_id, 1, 0,
+                                                   0, 0)))
+    return box(b"ftyp", b"iso6", struct.pack(">I", 0), b"iso6", b"mp41") + \
+        box(b"moov", mvhd, trak, mvex)
+
+
+def fragment_header(track_id, sequence, decode_time, size):
+    # The moof and the mdat header of a fragment of one sample of size bytes.
+    def moof(data_offset):
+        tfhd = full_box(b"tfhd", 0, 0x020000, struct.pack(">I", track_id))
+        tfdt = full_box(b"tfdt", 1, 0, struct.pack(">Q", decode_time))
+        trun = full_box(b"trun", 0, 0x000201,
+                        struct.pack(">IiI", 1, data_offset, size))
+        return box(b"moof", full_box(b"mfhd", 0, 0,
+                                     struct.pack(">I", sequence)),
+                   box(b"traf", tfhd, tfdt, trun))
+
+    data_offset = len(moof(0)) + 8
+    return moof(data_offset) + struct.pack(">I4s", 8 + size, b"mdat")
+
+
+def ts_payload(size):
+    # TS packets with a sync byte and filler, rounded to whole packets.
+    packets = max(size // TS_PACKET, 1)
+    packet = b"\x47\x1f\xff\x10" + bytes(TS_PACKET - 4)
+    return packet * packets
+
+
+def slide_image(format="jpeg"):
+    # JPEG slides are embedded as they are, the other formats get decoded.
+    from PIL import Image
+    out = BytesIO()
+    Image.effect_noise((1024, 768), 48).convert("RGB").save(
+            out, format.upper(), quality=85)
+    return out.getvalue()
+
+
+class Options(object):
+    def __init__(self, lectures=4, segments=30, segment_size=256 * 1024,
+                 raw_size=32 * 1024 * 1024, slides=20, slide_format="jpeg",
+                 page_size=200,
+                 latency=0.0, jitter=0.0, rate=None, throttle=0.0,
+                 errors=0.0, truncate=0.0, seed=None):
+        self.lectures = lectures
+        self.segments = segments
+        self.segment_size = segment_size
+        self.raw_size = raw_size
+        self.slides = slides
+        self.slide_format = slide_format
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.throttle = throttle
+        self.errors = errors
+        self.truncate = truncate
+        self.seed = seed
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    ROUTES = (
+        ("GET", r"/Mediasite/Catalog/catalogs/(\w+)$", "mediasite_catalog"),
+        ("POST", r"/Mediasite/Catalog/Data/GetPresentationsForFolder$",
+         "mediasite_presentations"),
+        ("GET", r"/Mediasite/Play/(\w+)-(\d+)$", "mediasite_player"),
+        ("POST", re.escape(SERVICE_PATH) + r"/GetPlayerOptions$",
+         "mediasite_options"),
+        ("GET", r"/media/(\w+-\d+)/manifest\.m3u8$", "mediasite_master"),
+        ("GET", r"/media/(\w+-\d+)/(audio|video)\.m3u8$",
+         "mediasite_playlist"),
+        ("GET", r"/media/\w+-\d+/(audio|video)_init\.mp4$", "fmp4_init"),
+        ("GET", r"/media/\w+-\d+/(audio|video)_(\d+)\.m4s$", "fmp4_segment"),
+        ("GET", r"/media/\w+-\d+/video\.mp4$", "raw_mp4"),
+        ("GET", r"/media/\w+-\d+/slides/slide_\d+\.jpg$", "slide"),
+        ("GET", r"/d2l/le/content/(\d+)/Home$", "brightspace_home"),
+        ("GET", r"/d2l/le/content/(\d+)/ModuleDetailsPartial$",
+         "brightspace_module"),
+        ("GET", r"/d2l/le/content/\d+/viewContent/(\d+)/View$",
+         "brightspace_topic"),
+        ("GET", r"/d2l/lp/lti/frame/(\d+)$", "brightspace_form"),
+        ("POST", r"/lti/launch/(\d+)$", "brightspace_player"),
+        ("GET", r"/statistics/get/session/$", "brightspace_session"),
+        ("GET", r"/api/v2/medias/modes/$", "brightspace_modes"),
+        ("GET", r"/hls/(\w+)/master\.m3u8$", "hls_master"),
+        ("GET", r"/hls/(\w+)/(\d+)p\.m3u8$", "hls_playlist"),
+        ("GET", r"/hls/\w+/seg_\d+\.ts$", "hls_segment"),
+    )
+    # Faults are only injected here, the scrapers do not retry.
+    FAULTY = ("fmp4_init", "fmp4_segment", "raw_mp4", "slide", "hls_segment")
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def options(self):
+        return self.server.options
+
+    @property
+    def base(self):
+        return "http://" + self.headers["Host"]
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_HEAD(self):
+        self.dispatch("HEAD")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length)
+        self.dispatch("POST")
+
+    def dispatch(self, method):
+        parsed = urlparse(self.path)
+        self.query = parse_qs(parsed.query)
+        for route_method, pattern, name in self.ROUTES:
+            if method != route_method and not (
+                    method == "HEAD" and route_method == "GET"):
+                continue
+            match = re.match(pattern, parsed.path)
+            if match is None:
+                continue
+            self.faulty = name in self.FAULTY
+            if self.faulty and self.fault():
+                return
+            return getattr(self, name)(*match.groups())
+        self.send_empty(404)
+
+    def fault(self):
+        # Sleeps the latency and answers with an injected fault, True if it
+        # did.
+        options = self.options
+        rand = self.server.random
+        delay = options.latency + rand.uniform(0, options.jitter)
+        if delay:
+            time.sleep(delay)
+        if rand.random() < options.throttle:
+            self.send_empty(429, {"Retry-After": "1"})
+            return True
+        if rand.random() < options.errors:
+            self.send_empty(500)
+            return True
+        return False
+
+    def send_empty(self, status, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_body(self, parts, content_type, status=200, headers=None,
+                  length=None):
+        # Sends the parts, at the bandwidth cap if there is one, cutting the
+        # body short if a truncation is injected.
+        if isinstance(parts, (bytes, str)):
+            parts = [parts]
+        parts = [part.encode() if isinstance(part, str) else part
+                 for part in parts]
+        if length is None:
+            length = sum(len(part) for part in parts)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        limit = length
+        if self.faulty and \
+                self.server.random.random() < self.options.truncate:
+            limit = length // 2
+            self.close_connection = True
+        rate = self.options.rate
+        sent = 0
+        start = time.monotonic()
+        for part in parts:
+            view = memoryview(part)
+            for pos in range(0, len(view), WRITE_CHUNK):
+                chunk = view[pos:pos + WRITE_CHUNK][:limit - sent]
+                if not chunk:
+                    return
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if rate:
+                    ahead = sent / rate - (time.monotonic() - start)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+    def send_json(self, data):
+        self.send_body(json.dumps(data), "application/json")
+
+    def send_html(self, text):
+        self.send_body(text, "text/html; charset=utf-8")
+
+    # Mediasite
+
+    def mediasite_catalog(self, kind):
+        if kind not in CATALOGS:
+            return self.send_empty(404)
+        self.send_html(pages.mediasite_catalog(self.options.page_size,
+                                               CATALOGS[kind]))
+
+    def mediasite_presentations(self):
+        request = json.loads(self.body)
+        kinds = {catalog: kind for kind, catalog in CATALOGS.items()}
+        kind = kinds.get(request["CatalogId"])
+        if kind is None:
+            return self.send_empty(404)
+        size = request["ItemsPerPage"]
+        start = request["PageIndex"] * size
+        lectures = range(start, min(start + size, self.options.lectures))
+        self.send_json({
+            "TotalItems": self.options.lectures,
+            "PresentationDetailsList": [{
+                "Id": "{}-{}".format(kind, i),
+                "Name": "Lecture {}".format(i),
+                "PlayerUrl": "{}/Mediasite/Play/{}-{}".format(self.base, kind,
+                                                              i)}
+                for i in lectures]})
+
+    def mediasite_player(self, kind, index):
+        self.send_html(pages.mediasite_player(
+                self.options.page_size, "{}-{}".format(kind, index)))
+
+    def mediasite_options(self):
+        request = json.loads(self.body)["getPlayerOptionsRequest"]
+        resource = request["ResourceId"]
+        kind = resource.split("-")[0]
+        media = "{}/media/{}/".format(self.base, resource)
+        if kind == "segmented":
+            stream = {"StreamType": 0, "VideoUrls": [{
+                "MimeType": "audio/x-mpegurl", "MediaType": "MP4",
+                "Location": media + "manifest.m3u8?playbackTicket=mock"}]}
+        elif kind == "raw":
+            stream = {"StreamType": 0, "VideoUrls": [{
+                "MimeType": "video/mp4", "MediaType": "MP4",
+                "Location": media + "video.mp4?playbackTicket=mock"}]}
+        elif kind == "slides":
+            stream = {"StreamType": 2, "SlideBaseUrl": media + "slides/",
+                      "Slides": [{"Number": i + 1}
+                                 for i in range(self.options.slides)],
+                      "SlideImageFileNameTemplate": "slide_{0:D4}.jpg"}
+        else:
+            return self.send_empty(404)
+        self.send_json({"d": {"Presentation": {"Streams": [stream]}}})
+
+    def mediasite_master(self, resource):
+        bandwidth = int(self.options.segment_size * 8 / SEGMENT_DURATION)
+        self.send_body(
+                "#EXTM3U\n"
+                "#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID=\"audio\",NAME=\"audio\","
+                "DEFAULT=YES,URI=\"audio.m3u8\"\n"
+                "#EXT-X-STREAM-INF:BANDWIDTH={},RESOLUTION=1280x720,"
+                "AUDIO=\"audio\"\nvideo.m3u8\n".format(bandwidth),
+                "application/vnd.apple.mpegurl")
+
+    def mediasite_playlist(self, resource, track):
+        lines = ["#EXTM3U", "#EXT-X-VERSION:7",
+                 "#EXT-X-TARGETDURATION:{:.0f}".format(SEGMENT_DURATION),
+                 "#EXT-X-MAP:URI=\"{}_init.mp4\"".format(track)]
+        for i in range(self.options.segments):
+            lines.append("#EXTINF:{:.3f},".format(SEGMENT_DURATION))
+            lines.append("{}_{}.m4s".format(track, i))
+        lines.append("#EXT-X-ENDLIST")
+        self.send_body("\n".join(lines) + "\n",
+                       "application/vnd.apple.mpegurl")
+
+    def fmp4_init(self, track):
+        track_id, handler, timescale = self.track(track)
+        duration = int(self.options.segments * SEGMENT_DURATION * timescale)
+        self.send_body(init_segment(track_id, handler, timescale, duration),
+                       "video/mp4")
+
+    def fmp4_segment(self, track, index):
+        track_id, _, timescale = self.track(track)
+        index = int(index)
+        payload = self.server.payload
+        header = fragment_header(track_id, index + 1,
+                                 int(index * SEGMENT_DURATION * timescale),
+                                 len(payload))
+        self.send_body([header, payload], "video/iso.segment")
+
+    @staticmethod
+    def track(track):
+        if track == "audio":
+            return 1, b"soun", 48000
+        return 2, b"vide", 90000
+
+    def raw_mp4(self):
+        size = self.options.raw_size
+        start, end, status, headers = 0, size - 1, 200, {
+            "Accept-Ranges": "bytes"}
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if start >= size:
+                return self.send_empty(416, {
+                    "Content-Range": "bytes */{}".format(size)})
+            if match.group(2):
+                end = min(int(match.group(2)), size - 1)
+            status = 206
+            headers["Content-Range"] = "bytes {}-{}/{}".format(start, end,
+                                                               size)
+        self.send_body(self.server.raw_parts(start, end + 1), "video/mp4",
+                       status, headers, end + 1 - start)
+
+    def slide(self):
+        self.send_body(self.server.slide, "image/jpeg")
+
+    # Brightspace
+
+    def brightspace_home(self, course):
+        self.send_html(pages.brightspace_course_home(
+                max(self.options.page_size, 1),
+                max(self.options.page_size, 1) - 1))
+
+    def brightspace_module(self, course):
+        html = pages.brightspace_module(self.options.lectures, course)
+        self.send_body("while(1);" + json.dumps({"Payload": {"Html": html}}),
+                       "application/json")
+
+    def brightspace_topic(self, lecture):
+        self.send_html(pages.brightspace_topic(
+                self.options.page_size,
+                "/d2l/lp/lti/frame/{}".format(lecture)))
+
+    def brightspace_form(self, lecture):
+        self.send_html(pages.brightspace_form(
+                action="{}/lti/launch/{}".format(self.base, lecture)))
+
+    def brightspace_player(self, lecture):
+        self.send_html(pages.brightspace_player(self.options.page_size,
+                                                "oid{}".format(lecture)))
+
+    def brightspace_session(self):
+        self.send_json({})
+
+    def brightspace_modes(self):
+        oid = self.query["oid"][0]
+        self.send_json({"Auto": {
+            "html5": "{}/hls/{}/master.m3u8".format(self.base, oid)}})
+
+    def hls_master(self, oid):
+        lines = ["#EXTM3U"]
+        for height, scale in ((360, 4), (720, 2), (1080, 1)):
+            bandwidth = int(self.options.segment_size * 8 / SEGMENT_DURATION
+                            / scale)
+            lines.append("#EXT-X-STREAM-INF:BANDWIDTH={},RESOLUTION={}x{}"
+                         .format(bandwidth, height * 16 // 9, height))
+            lines.append("{}/hls/{}/{}p.m3u8".format(self.base, oid, height))
+        self.send_body("\n".join(lines) + "\n",
+                       "application/vnd.apple.mpegurl")
+
+    def hls_playlist(self, oid, height):
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3",
+                 "#EXT-X-TARGETDURATION:{:.0f}".format(SEGMENT_DURATION)]
+        for i in range(self.options.segments):
+            lines.append("#EXTINF:{:.3f},".format(SEGMENT_DURATION))
+            lines.append("seg_{}.ts".format(i))
+        lines.append("#EXT-X-ENDLIST")
+        self.send_body("\n".join(lines) + "\n",
+                       "application/vnd.apple.mpegurl")
+
+    def hls_segment(self):
+        self.send_body(self.server.ts_payload, "video/mp2t")
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, options=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), Handler)
+        self.options = options or Options()
+        self.random = random.Random(self.options.seed)
+        # Bodies are generated once and shared by all responses.
+        self.payload = random.Random(1).getrandbits(
+                self.options.segment_size * 8).to_bytes(
+                self.options.segment_size, "big")
+        self.ts_payload = ts_payload(self.options.segment_size)
+        self.block = self.payload or b"\0"
+        self.slide = slide_image(self.options.slide_format)
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    def raw_parts(self, start, end):
+        # The raw MP4 is the payload block repeated.
+        block = len(self.block)
+        pos = start
+        while pos < end:
+            offset = pos % block
+            part = self.block[offset:offset + min(block - offset, end - pos)]
+            yield part
+            pos += len(part)
+
+    def handle_error(self, request, client_address):
+        # Clients drop connections all the time, hedged and cancelled fetches
+        # do, so that is no error.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       name="mockserver", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def parse_size(value):
+    # Bytes, optionally with a K, M or G suffix.
+    units = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    match = re.match(r"^(\d+(?:\.\d+)?)([kKmMgG]?)$", value)
+    if match is None:
+        raise ValueError("Invalid size: {}.".format(value))
+    return int(float(match.group(1)) * units[match.group(2).lower()])
+
+
+def add_options(parser):
+    parser.add_argument("--lectures", type=int, default=4,
+                        help="Number of lectures in every course.")
+    parser.add_argument("--segments", type=int, default=30,
+                        help="Number of segments per track.")
+    parser.add_argument("--segment-size", type=parse_size, default=256 * 1024,
+                        help="Size of a segment, K, M and G suffixes allowed.")
+    parser.add_argument("--raw-size", type=parse_size, default=32 * 1024 ** 2,
+                        help="Size of a raw MP4 stream.")
+    parser.add_argument("--slides", type=int, default=20,
+                        help="Number of slides per lecture.")
+    parser.add_argument("--slide-format", choices=["jpeg", "png", "webp"],
+                        default="jpeg",
+                        help="Image format of the slides.")
+    parser.add_argument("--page-size", type=int, default=200,
+                        help="Amount of padding in the pages.")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds before every media response.")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Up to this many more seconds, at random.")
+    parser.add_argument("--rate", type=parse_size, default=None,
+                        help="Bandwidth cap of a media response in bytes per second.")
+    parser.add_argument("--throttle", type=float, default=0.0,
+                        help="Fraction of media requests answered with 429.")
+    parser.add_argument("--errors", type=float, default=0.0,
+                        help="Fraction of media requests answered with 500.")
+    parser.add_argument("--truncate", type=float, default=0.0,
+                        help="Fraction of media responses cut short.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed of the fault injection.")
+
+
+def options_from(args):
+    return Options(**{key: getattr(args, key)
+                      for key in vars(Options())})
+
+
+def main():
+    parser = argparse.ArgumentParser("mockserver.py",
+                                     description="Local Mediasite and Brightspace stand-in.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_options(parser)
+    args = parser.parse_args()
+    server = MockServer(options_from(args), args.host, args.port)
+    for kind in MEDIASITE_KINDS:
+        print("[*] Mediasite {}: {}/Mediasite/Catalog/catalogs/{}".format(
+                kind, server.url, kind))
+    print("[*] Brightspace: {}/d2l/home/1234".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,115 @@
+# Synthetic Brightspace and Mediasite pages, shaped like the real ones where
+# the scrapers look and padded with the kind of markup that surrounds it.
+# Used by the benchmarks when no saved pages are given.
+
+import json
+
+PADDING = """<div class="d2l-navigation-s-item"><a class="d2l-navigation-s-link"
+ href="/d2l/home/{i}" data-index="{i}"><span class="d2l-icon">&#9632;</span>
+ <span class="d2l-navigation-s-title">Navigation entry {i}</span></a>
+ <script type="text/javascript">D2L.LP.Web.UI.ObjectRepository.TryAdd(
+ "item{i}", {{"Id": {i}, "Visible": true}});</script></div>
+"""
+
+
+def padding(count):
+    return "".join(PADDING.format(i=i) for i in range(count))
+
+
+def page(body, head=""):
+    return ("<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+            "<title>Page</title>{}</head><body>{}</body></html>").format(
+            head, body)
+
+
+def brightspace_topic(size=200, frame="/d2l/lp/lti/frame/123"):
+    # The topic page with the iframe of the form in its content view.
+    return page(padding(size) + """
+<div id="ContentView"><div class="d2l-page-main">
+<iframe class="d2l-iframe d2l-iframe-fit-user-content"
+ src="{}"></iframe></div></div>""".format(frame) + padding(size // 4))
+
+
+def brightspace_form(fields=12,
+                     action="https://player.example.org/lti/launch"):
+    inputs = "".join("<input type=\"hidden\" name=\"field{0}\" "
+                     "value=\"value{0}\">".format(i) for i in range(fields))
+    return page("<form method=\"post\" action=\"{}\">{}</form>".format(
+            action, inputs))
+
+
+def brightspace_player(size=200, oid="v12b2f7e2a2f7mqrbbr0"):
+    player = {"media_oid": oid, "autoplay": False,
+              "title": "Lecture"}
+    scripts = "".join("<script>var config{0} = {{\"value\": {0}}};</script>"
+                      .format(i) for i in range(size // 4))
+    return page(padding(size) + scripts + """
+<script src="/static/player.js"></script>
+<script type="text/javascript">
+var player = new Player({});
+</script>""".format(json.dumps(player)))
+
+
+def brightspace_course_home(modules=300, video_module=250):
+    # The content menu, the entry text sits seven levels below the element
+    # carrying the module id.
+    entries = []
+    for i in range(modules):
+        title = "Video recordings" if i == video_module else \
+            "Module {}".format(i)
+        entries.append(
+                "<li id=\"TreeItem-{0}\" class=\"d2l-le-TreeAccordionItem\">"
+                "<div class=\"d2l-le-TreeAccordionItem-anchor\">"
+                "<span class=\"d2l-icon\"></span><div>"
+                "<a href=\"#\" data-key=\"{0}\"><span class=\"d2l-textblock\">"
+                "<span><span><div>{1}</div></span></span></span></a>"
+                "<span class=\"d2l-count\">{0}</span></div></div>"
+                "<ul><li><div class=\"d2l-datalist-item-content\">"
+                "<span>Topic of module {0}</span></div></li></ul></li>"
+                .format(6000 + i, title))
+    return page(padding(200) + "<ul class=\"d2l-le-TreeAccordion\">" +
+                "".join(entries) + "</ul>" + padding(50))
+
+
+def brightspace_module(lectures=60, course=1234):
+    links = "".join(
+            "<li class=\"d2l-datalist-item\"><div class=\"d2l-datalist-item-"
+            "content\"><a class=\"d2l-link d2l-datalist-item-actioncontrol\" "
+            "href=\"/d2l/le/content/{2}/viewContent/{0}/View\">"
+            "Lecture {0}/{1}</a><div class=\"d2l-textblock\">Video</div>"
+            "</div></li>".format(i, lectures, course)
+            for i in range(lectures))
+    return "<div class=\"d2l-placeholder\"><ul class=\"vui-list d2l-" \
+           "datalist\">{}</ul></div>".format(links)
+
+
+def mediasite_player(size=200,
+                     resource_id="0f8e2a2d57b84d0b9d1c7c2f52fa1b1d1d"):
+    return page(padding(size) + """
+<div id="GlobalData" style="display: none">
+<span id="ResourceId">{}</span>
+<span id="ServicePath">/Mediasite/PlayerService/PlayerService.svc/json</span>
+<span id="Culture">en-US</span></div>""".format(resource_id) +
+                padding(size // 4))
+
+
+def mediasite_catalog(size=200,
+                      catalog_id="9e4c01e4-1b29-4bbd-8e26-d0e0a5f5bb2f"):
+    scripts = "".join("<script>var catalog{0} = {{\"page\": {0}}};</script>"
+                      .format(i) for i in range(size // 4))
+    return page("<form id=\"MainForm\">" + padding(size) + scripts + """
+<script type="text/javascript">
+SFMS.Catalog.Load({{ CatalogId: '{}',
+                    CurrentFolderId: '' }});
+</script></form>""".format(catalog_id))
+
+
+PAGES = {
+    "brightspace_topic": brightspace_topic,
+    "brightspace_form": brightspace_form,
+    "brightspace_player": brightspace_player,
+    "brightspace_course_home": brightspace_course_home,
+    "brightspace_module": brightspace_module,
+    "mediasite_player": mediasite_player,
+    "mediasite_catalog": mediasite_catalog,
+}
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+# Micro-benchmarks of the page scrapers: the lxml XPath scrapers against the
+# BeautifulSoup code they replaced, on the same pages. Pages are read from a
+# fixtures directory, as <name>.html, and generated where missing.
+#
+#   python benchmarks/scraping.py [--fixtures DIR] [--runs 20] [--save DIR]
+#
+import argparse
+import re
+import statistics
+import sys
+import time
+from itertools import islice
+from os import makedirs
+from os.path import abspath, dirname, exists, join
+
+sys.path.insert(0, join(dirname(abspath(__file__)), "..", "src", "bsms"))
+
+import scrape  # noqa: E402
+from pages import PAGES  # noqa: E402
+
+
+def soup(text):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(text, "lxml")
+
+
+def bs4_content_iframe(text):
+    return soup(text).find(id="ContentView").find(class_="d2l-iframe")["src"]
+
+
+def bs4_form_fields(text):
+    page = soup(text)
+    return page.find("form")["action"], {input["name"]: input["value"]
+                                         for input in page.find_all("input")}
+
+
+def bs4_player_script(text):
+    return soup(text).find(
+            lambda elem: elem.name == "script" and not elem.has_attr(
+                    "src") and "new Player" in elem.string).string
+
+
+def bs4_videos_module_id(text):
+    link = soup(text).find(lambda elem: False if elem.string is None else (
+            "Video" in elem.string and elem.name == "div"))
+    return next(islice(link.parents, 6, None))["id"].split("-")[-1]
+
+
+def bs4_lecture_links(html):
+    lst = soup(html).find(class_="vui-list")
+    return [(item["href"], item.string)
+            for item in lst.find_all("a", class_="d2l-link")]
+
+
+def bs4_global_data(text, *names):
+    global_data = soup(text).find(id="GlobalData")
+    return [global_data.find(id=name).string for name in names]
+
+
+def bs4_catalog_id(text):
+    catalog_id = None
+    catalog_id_re = re.compile(r"CatalogId: *'([a-f0-9\-]+?)'")
+    for script in soup(text).find(id="MainForm").find_all("script"):
+        match = catalog_id_re.search(script.string)
+        if match:
+            catalog_id = match.group(1)
+    return catalog_id
+
+
+CASES = (
+    ("brightspace_topic", scrape.content_iframe, bs4_content_iframe, ()),
+    ("brightspace_form", scrape.form_fields, bs4_form_fields, ()),
+    ("brightspace_player", scrape.player_script, bs4_player_script, ()),
+    ("brightspace_course_home", scrape.videos_module_id,
+     bs4_videos_module_id, ()),
+    ("brightspace_module", scrape.lecture_links, bs4_lecture_links, ()),
+    ("mediasite_player", scrape.global_data, bs4_global_data,
+     ("ResourceId", "ServicePath")),
+    ("mediasite_catalog", scrape.catalog_id, bs4_catalog_id, ()),
+)
+
+
+def load(fixtures, name):
+    if fixtures:
+        fname = join(fixtures, name + ".html")
+        if exists(fname):
+            with open(fname, encoding="utf-8") as f:
+                return f.read()
+    return PAGES[name]()
+
+
+def measure(func, text, args, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(text, *args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser("scraping.py",
+                                     description="Page scraper micro-benchmarks.")
+    parser.add_argument("--fixtures", default=None,
+                        help="Directory of saved pages, named <name>.html.")
+    parser.add_argument("--save", default=None,
+                        help="Write the generated pages into a directory and exit.")
+    parser.add_argument("--runs", type=int, default=20,
+                        help="Number of runs of each scraper.")
+    args = parser.parse_args()
+
+    if args.save:
+        makedirs(args.save, exist_ok=True)
+        for name, build in PAGES.items():
+            with open(join(args.save, name + ".html"), "w",
+                      encoding="utf-8") as f:
+                f.write(build())
+        return 0
+
+    try:
+        import bs4  # noqa: F401
+        compare = True
+    except ImportError:
+        print("[!] BeautifulSoup not installed, only timing lxml.")
+        compare = False
+
+    print("{:26} {:>8} {:>10} {:>10} {:>8}".format(
+            "page", "KiB", "bs4 ms", "lxml ms", "speedup"))
+    for name, new, old, extra in CASES:
+        text = load(args.fixtures, name)
+        got = new(text, *extra)
+        lxml_time = measure(new, text, extra, args.runs)
+        if compare:
+            expected = old(text, *extra)
+            if got != expected:
+                print("[!] {}: lxml got {!r}, bs4 got {!r}.".format(
+                        name, got, expected))
+                return 1
+            bs4_time = measure(old, text, extra, args.runs)
+            print("{:26} {:8.1f} {:10.2f} {:10.2f} {:7.1f}x".format(
+                    name, len(text) / 1024, bs4_time * 1000,
+                    lxml_time * 1000, bs4_time / lxml_time))
+        else:
+            print("{:26} {:8.1f} {:>10} {:10.2f} {:>8}".format(
+                    name, len(text) / 1024, "-", lxml_time * 1000, "-"))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
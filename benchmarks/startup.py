@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+#
+# Startup benchmark of the entry points. Each run is a fresh interpreter that
+# imports the entry point and then does its first request, through the page
+# cache like the scrapers do, against a local server.
+#
+#   python benchmarks/startup.py [--runs 20] [--json]
+#
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import abspath, dirname, join
+
+SRC = join(dirname(abspath(__file__)), "..", "src", "bsms")
+ENTRY_POINTS = ("brightspace", "mediasite", "daemon")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+import utils
+from cache import get_cache
+get_cache().get(utils.create_session(), sys.argv[1]).content
+done = time.perf_counter()
+print(json.dumps({{"import": imported - start,
+                  "first_request": done - imported}}))
+"""
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b"<html><body>bsms</body></html>"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_once(module, url):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", PROBE.format(module=module),
+                          url], cwd=SRC, check=True, stdout=subprocess.PIPE,
+                         universal_newlines=True).stdout
+    result = json.loads(out)
+    result["process"] = time.perf_counter() - start
+    return result
+
+
+def summary(values):
+    values = sorted(values)
+    return {"median": statistics.median(values),
+            "p90": values[min(len(values) - 1, int(len(values) * 0.9))],
+            "min": values[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser("startup.py",
+                                     description="Entry point startup benchmark.")
+    parser.add_argument("--runs", type=int, default=10,
+                        help="Number of fresh interpreters per entry point.")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON.")
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS,
+                        help="Entry points to measure.")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/".format(server.server_port)
+
+    results = {}
+    for module in args.modules:
+        runs = [run_once(module, url) for _ in range(args.runs)]
+        results[module] = {key: summary([run[key] for run in runs])
+                           for key in ("import", "first_request", "process")}
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    print("{:12} {:>22} {:>22} {:>22}".format(
+            "entry point", "import ms", "first request ms", "process ms"))
+    for module, result in results.items():
+        print("{:12} {:>22} {:>22} {:>22}".format(module, *(
+                "{:.1f} (p90 {:.1f})".format(result[key]["median"] * 1000,
+                                            result[key]["p90"] * 1000)
+                for key in ("import", "first_request", "process"))))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -9,18 +9,19 @@ setup(
         version="0.1.0",
         license="MIT",
         install_requires=["requests",
-                          "beautifulsoup4",
                           "lxml",
                           "pyaml",
                           "m3u8",
-                          "fpdf",
                           "pillow"],
+        extras_require={"async": ["aiohttp"]},
         packages=["bsms"],
         package_dir={'': 'src'},
         entry_points={
             "console_scripts": [
                 "brightspace = bsms.brightspace",
-                "mediasite = bsms.mediasite"
+                "mediasite = bsms.mediasite",
+                "bsms-daemon = bsms.daemon",
+                "bsms-batch = bsms.batch"
             ]
         },
         description="Python BrightSpace & MediaSite content downloader",
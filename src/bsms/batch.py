@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# brightspace and mediasite batch downloader
+# Copyright (c) 2018 Jan Jancar <johny@neuromancer.sk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Downloads all lectures and courses of a job file in one process, sharing
+# sessions, connection pools and the page cache between them. The job file is
+# YAML, a list of jobs, or JSON lines, a job per line:
+#
+#   {"platform": "brightspace", "kind": "course", "url": "...",
+#    "output": "...", "cookies_file": "..."}
+#
+# A job may carry its own cookies, inline as "cookies" or in a
+# "cookies_file", otherwise the --cookies of its platform are used. A plan
+# written by --plan is a job file too, its lectures are downloaded without
+# scraping them again.
+
+import json
+from argparse import ArgumentParser
+
+from daemon import read_cookies
+from downloader import Downloader, add_options
+from plan import plan_jobs
+from scheduler import Scheduler
+
+BATCH_OPTIONS = ("job_file", "batch_jobs", "cookies", "output_root")
+
+
+def read_jobs(fname):
+    with open(fname) as f:
+        if fname.endswith((".yaml", ".yml")):
+            import yaml
+            jobs = yaml.safe_load(f) or []
+        else:
+            text = f.read()
+            try:
+                jobs = json.loads(text)
+            except ValueError:
+                jobs = [json.loads(line) for line in text.splitlines()
+                        if line.strip() and not line.lstrip().startswith("#")]
+    if isinstance(jobs, dict):
+        jobs = plan_jobs(jobs) if "lectures" in jobs else [jobs]
+    if not isinstance(jobs, list) or not all(isinstance(job, dict)
+                                             for job in jobs):
+        raise ValueError("A job file is a list of jobs.")
+    return jobs
+
+
+def run_job(downloader, job):
+    print("[ ] Job: {} {} into {}.".format(job["platform"], job["url"],
+                                           job["output"]))
+    return downloader.download(job)
+
+
+def main():
+    parser = ArgumentParser("batch.py",
+                            description="Brightspace and Mediasite batch downloader.",
+                            epilog="Licensed under MIT license. Copyright (C) 2018 Jan Jancar")
+    parser.add_argument("--batch-jobs", dest="batch_jobs", type=int,
+                        default=4,
+                        help="Number of jobs of the file to run at once.")
+    parser.add_argument("--cookies", dest="cookies", action="append",
+                        default=[], metavar="PLATFORM=FILE",
+                        help="Read the session cookies of a platform from a file.")
+    parser.add_argument("--output-root", dest="output_root", default=".",
+                        help="Directory the job outputs are relative to.")
+    add_options(parser)
+    parser.add_argument("job_file", type=str,
+                        help="YAML or JSON lines file of jobs, or a plan.")
+    config = parser.parse_args()
+
+    jobs = read_jobs(config.job_file)
+    options = {key: value for key, value in vars(config).items()
+               if key not in BATCH_OPTIONS}
+    with Downloader(read_cookies(config.cookies), config.output_root,
+                    **options) as downloader, \
+            Scheduler(config.batch_jobs) as scheduler:
+        print("[ ] Running {} jobs.".format(len(jobs)))
+        for job in jobs:
+            scheduler.submit(run_job, downloader, job)
+        ok = scheduler.wait()
+    print("[*] Done!" if ok else "[!] Some jobs failed.")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -22,73 +22,79 @@
 # SOFTWARE.
 
 import time
-from itertools import islice
 
 import json
-import m3u8
 import re
 import requests
-import yaml
 from argparse import ArgumentParser
-from bs4 import BeautifulSoup
-from functools import reduce
 from http import cookies
 from os import makedirs
 from os.path import split, exists, join
 from urllib.parse import urljoin, urlparse
 
+import scrape
 import utils
-from utils import vprint, get_user_agent, get_url_root, download_segments, create_session
+from cache import get_cache, session_identity
+from scheduler import Scheduler
+from store import store_output
+from sync import SyncManifest, fingerprint, sync_lecture
+from journal import download_segments_resumable
+from metrics import get_metrics
+from plan import planning, add_lecture, get_lecture_jobs, write_plan
+from utils import vprint, get_user_agent, get_url_root, create_session, parse_playlist, add_common_options
+from variants import select_variant, playlist_duration, max_size_bytes
 
 
 def unix_time():
     return int(round(time.time() * 1000))
 
 
-def download_lecture(lecture_url, output_name, session):
-    print(
-            "[ ] Downloading lecture {} into {}.".format(lecture_url,
-                                                         output_name))
+def get_player_page(lecture_url, session):
+    # The form carries a one-time nonce, so the resulting player page is
+    # cached under the lecture url and the account.
+    pages = get_cache()
+    player_key = "player:{}:{}".format(session_identity(session), lecture_url)
+    iframe_view = pages.lookup(player_key)
+    if iframe_view is not None:
+        vprint("[*] Cached player page.")
+        return iframe_view
 
     # Get the root
     full_root = get_url_root(lecture_url)
 
     # Load the video page.
     vprint("[ ] Get video page.")
-    view = session.get(lecture_url)
-    view_page = BeautifulSoup(view.text, "lxml")
+    view = pages.get(session, lecture_url)
     # Find the iframe.
-    content_view = view_page.find(id="ContentView")
-    form_src = content_view.find(class_="d2l-iframe")["src"]
+    form_src = scrape.content_iframe(view.text)
 
     # Load the iframe (its a form we need to go through).
     vprint("[ ] Get form iframe.")
     form_view = session.get(urljoin(full_root, form_src))
-    form_page = BeautifulSoup(form_view.text, "lxml")
     # Parse the form.
-    form = form_page.find("form")
-    inputs = form_page.find_all("input")
-
-    submit_url = form["action"]
-    form_data = {}
-    for input in inputs:
-        form_data[input["name"]] = input["value"]
-
-    # Use the proper root.
-    download_root = get_url_root(submit_url)
+    submit_url, form_data = scrape.form_fields(form_view.text)
 
     # Submit the form and get actual video iframe.
     vprint("[ ] Submit form iframe.")
     iframe_view = session.post(submit_url, data=form_data)
-    iframe_page = BeautifulSoup(iframe_view.text, "lxml")
+    pages.store(player_key, iframe_view)
+    return iframe_view
+
+
+def resolve_lecture(lecture_url, session):
+    # Scrapes a lecture down to the urls of its segments, as a stream of a
+    # plan.
+    pages = get_cache()
+    iframe_view = get_player_page(lecture_url, session)
+
+    # Use the proper root.
+    download_root = get_url_root(iframe_view.url)
 
     # Get the player initialization dict.
-    player_javascript = iframe_page.find(
-            lambda elem: elem.name == "script" and not elem.has_attr(
-                    "src") and "new Player" in elem.string)
-    dict_match = re.search("new Player\((.+)\)", player_javascript.string,
-                           re.DOTALL)
-    player_dict = yaml.load(dict_match.group(1))
+    player_javascript = scrape.player_script(iframe_view.text)
+    dict_match = re.search("new Player\((.+)\)", player_javascript, re.DOTALL)
+    import yaml
+    player_dict = yaml.safe_load(dict_match.group(1))
     oid = player_dict["media_oid"]
 
     # Register a session.
@@ -98,33 +104,66 @@ def download_lecture(lecture_url, output_name, session):
 
     # Query the modes.
     vprint("[ ] Get the modes.")
-    modes_view = session.get(urljoin(download_root, "/api/v2/medias/modes/"),
-                             params={"html5": "webm_ogg_ogv_oga_mp4_mp3_m3u8",
-                                     "oid": oid})
+    modes_view = pages.get(session,
+                           urljoin(download_root, "/api/v2/medias/modes/"),
+                           params={"html5": "webm_ogg_ogv_oga_mp4_mp3_m3u8",
+                                   "oid": oid})
     modes = modes_view.json()
 
     # Get the adaptive playlist.
     vprint("[ ] Get adaptive playlist.")
-    adaptive_view = session.get(modes["Auto"]["html5"])
-    adaptive = m3u8.loads(adaptive_view.text)
+    adaptive_view = pages.get(session, modes["Auto"]["html5"])
+    adaptive = parse_playlist(adaptive_view.text)
+
+    # Pick the stream, all variants have the same duration so any playlist
+    # tells it.
+    def get_duration():
+        duration_view = pages.get(session, adaptive.playlists[0].uri)
+        return playlist_duration(parse_playlist(duration_view.text))
 
-    # Get the best stream.
-    max_res = reduce(
-            lambda cumul, cur: cumul if cumul.stream_info.resolution[0] >
-                                        cur.stream_info.resolution[0] else cur,
-            adaptive.playlists)
+    variant = select_variant(adaptive.playlists, config.quality,
+                             config.max_bitrate,
+                             max_size_bytes(config.max_size), get_duration)
 
     # Get its playlist.
-    vprint("[ ] Got best stream, resolution={}.".format(
-            max_res.stream_info.resolution))
-    playlist_view = session.get(max_res.uri)
-    resource_base = urljoin(max_res.uri, ".")
-    playlist = m3u8.loads(playlist_view.text)
+    vprint("[ ] Got stream, resolution={}, bandwidth={}.".format(
+            variant.stream_info.resolution, variant.stream_info.bandwidth))
+    playlist_view = pages.get(session, variant.uri)
+    resource_base = urljoin(variant.uri, ".")
+    playlist = parse_playlist(playlist_view.text)
+    return {"type": "ts", "suffix": ".ts", "params": None,
+            "tracks": [[urljoin(resource_base, segment.uri)
+                        for segment in playlist.segments]],
+            "duration": playlist_duration(playlist)}
+
+
+def download_lecture(lecture_url, output_name, session, files=None):
+    print(
+            "[ ] Downloading lecture {} into {}.".format(lecture_url,
+                                                         output_name))
+    started = time.monotonic()
+    stream = resolve_lecture(lecture_url, session)
 
+    if planning():
+        add_lecture("brightspace", lecture_url, output_name, [stream],
+                    session)
+        return True
     if config.dry_run:
         return True
 
-    output_name = output_name + ".ts"
+    stats = get_metrics().get(output_name, output_name + stream["suffix"])
+    stats.add_time("scrape", time.monotonic() - started)
+    return download_resolved(stream, output_name, session, files, stats)
+
+
+def download_resolved(stream, output_name, session, files=None, stats=None):
+    # Downloads a resolved stream into the output name with its suffix.
+    if stats is None:
+        stats = get_metrics().get(output_name, output_name + stream["suffix"])
+    output_name = output_name + stream["suffix"]
+
+    if files is not None:
+        files.append((output_name, stream["type"]))
 
     if exists(output_name):
         print(
@@ -133,13 +172,24 @@ def download_lecture(lecture_url, output_name, session):
         return True
 
     # Get the segments.
-    vprint("[ ] Downloading segments({}).".format(len(playlist.segments)))
-    with open(output_name, "wb") as out:
-        download_segments(session, (urljoin(resource_base, segment.uri)
-                                    for segment in playlist.segments), out)
+    urls = stream["tracks"][0]
+    vprint("[ ] Downloading segments({}).".format(len(urls)))
+    with stats.phase("fetch"):
+        download_segments_resumable(session, urls, output_name, stats=stats,
+                                    max_workers=config.segment_workers,
+                                    window=config.segment_window)
+    store_output(output_name)
     return True
 
 
+def download_planned(lecture, session, files=None):
+    # Downloads a lecture of a plan, its segments are resolved already.
+    print("[ ] Downloading planned lecture {} into {}.".format(
+            lecture["url"], lecture["output"]))
+    return all([download_resolved(stream, lecture["output"], session, files)
+                for stream in lecture["streams"]])
+
+
 def download_course(course_url, output_name, session):
     print("[ ] Downloading course {}.".format(course_url))
     # Parse the course url.
@@ -152,14 +202,10 @@ def download_course(course_url, output_name, session):
 
     # Get the course content home.
     vprint("[ ] Get course home.")
-    home_view = session.get(content_home)
-    soup = BeautifulSoup(home_view.text, "lxml")
+    home_view = get_cache().get(session, content_home)
 
     # Find the videos menu entry.
-    videos_link = soup.find(lambda elem: False if elem.string is None else (
-            "Video" in elem.string and elem.name == "div"))
-    videos_module = next(islice(videos_link.parents, 6, None))
-    module_id = videos_module["id"].split("-")[-1]
+    module_id = scrape.videos_module_id(home_view.text)
 
     # Get the videos module.
     data = {
@@ -174,28 +220,45 @@ def download_course(course_url, output_name, session):
     module_details = urljoin(root, "le/content/" + str(
             course_id) + "/ModuleDetailsPartial")
     vprint("[ ] Get video module.")
-    module_view = session.get(module_details, params=data)
+    module_view = get_cache().get(session, module_details, params=data)
     module_html = json.loads(module_view.text.split(";", 1)[1])["Payload"][
         "Html"]
 
     # Find the lecture list.
-    module_soup = BeautifulSoup(module_html, "lxml")
-    lst = module_soup.find(class_="vui-list")
-    lectures = lst.find_all("a", class_="d2l-link")
+    lectures = scrape.lecture_links(module_html)
 
-    # Make sure the directory exists.
-    makedirs(output_name, exist_ok=True)
+    # Make sure the directory exists, a plan is only written.
+    if not planning():
+        makedirs(output_name, exist_ok=True)
 
     # Download lectures.
     print("[ ] Downloading {} lectures into {}.".format(len(lectures),
                                                         output_name))
-    for item in lectures:
-        lecture_url = urljoin(full_root, item["href"])
-        if not download_lecture(lecture_url, join(output_name, item.string.replace("/", "-")),
-                                session):
-            return False
-    return True
-
+    # The module listing has no modification times, so a lecture is
+    # identified by its link and title.
+    lectures = [(href, fingerprint({"href": href, "title": title}),
+                 urljoin(full_root, href),
+                 title.replace("/", "-")) for href, title in lectures]
+    manifest = None
+    if config.sync:
+        manifest = SyncManifest(output_name)
+        lectures = manifest.changed(lectures)
+    with Scheduler(get_lecture_jobs(), capped=True) as scheduler:
+        for lecture_id, lecture_fingerprint, lecture_url, name in lectures:
+            if manifest is not None:
+                scheduler.submit(sync_lecture, manifest, lecture_id,
+                                 lecture_fingerprint, download_lecture,
+                                 lecture_url, join(output_name, name),
+                                 session, config.dry_run or planning())
+            else:
+                scheduler.submit(download_lecture, lecture_url,
+                                 join(output_name, name), session)
+        return scheduler.wait()
+
+
+def add_options(parser):
+    # The options, shared by the command line and the library API.
+    add_common_options(parser)
 
 def main():
     global config
@@ -207,10 +270,7 @@ def main():
                        help="A URL of a lecture to download.")
     group.add_argument("--course", dest="course_url",
                        help="A URL of a course to download all of its lectures.")
-    parser.add_argument("-n", "--dry-run", dest="dry_run", action="store_true",
-                        help="Do not download anything.")
-    parser.add_argument("-v", "--verbose", dest="verbose", action="store_true",
-                        help="Enable verbose output.")
+    add_options(parser)
     parser.add_argument("output", type=str,
                         help="Output name, a partial filename in case of a single lecture download, "
                              "or a directory in case of a course download.")
@@ -229,6 +289,7 @@ def main():
             if not download_course(config.course_url, config.output, session):
                 return 1
 
+    write_plan()
     print("[*] Done!")
     return 0
 
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import utils
+from utils import vprint
+
+
+def session_identity(session):
+    # Pages are cached per account, one fetched with other or expired
+    # cookies, like a login page, must not be served to another session.
+    return getattr(session, "identity", None)
+
+
+def request_key(session, method, url, kwargs):
+    return hashlib.sha256(json.dumps(
+            [session_identity(session), method, url, kwargs.get("params"),
+             kwargs.get("data"), kwargs.get("json")], sort_keys=True,
+            default=str).encode()).hexdigest()
+
+
+class PageCache(object):
+    # On-disk cache of scraped pages and API responses, entries are fresh for
+    # `ttl` seconds and revalidated with ETag/Last-Modified afterwards.
+    def __init__(self, path, ttl=3600):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS pages ("
+                            "key TEXT PRIMARY KEY, url TEXT, status INTEGER, "
+                            "headers TEXT, encoding TEXT, body BLOB, "
+                            "stored REAL)")
+
+    def _load(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT url, status, headers, encoding, "
+                                  "body, stored FROM pages WHERE key = ?",
+                                  (key,)).fetchone()
+        if row is None:
+            return None, None
+        resp = requests.Response()
+        resp.url, resp.status_code, headers, resp.encoding, body, stored = row
+        resp.headers = CaseInsensitiveDict(json.loads(headers))
+        resp._content = body
+        return resp, stored
+
+    def _touch(self, key):
+        with self.lock, self.db:
+            self.db.execute("UPDATE pages SET stored = ? WHERE key = ?",
+                            (time.time(), key))
+
+    def store(self, key, resp):
+        if resp.status_code != 200:
+            return
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO pages VALUES "
+                            "(?, ?, ?, ?, ?, ?, ?)",
+                            (key, resp.url, resp.status_code,
+                             json.dumps(dict(resp.headers)), resp.encoding,
+                             resp.content, time.time()))
+
+    def lookup(self, key):
+        # Returns a fresh entry stored under a caller chosen key, these can
+        # not be revalidated.
+        resp, stored = self._load(key)
+        if resp is not None and time.time() - stored < self.ttl:
+            return resp
+        return None
+
+    def request(self, session, method, url, **kwargs):
+        key = request_key(session, method, url, kwargs)
+        cached, stored = self._load(key)
+        if cached is not None:
+            if time.time() - stored < self.ttl:
+                vprint("[*] Cached: {}.".format(url))
+                return cached
+            headers = dict(kwargs.pop("headers", None) or {})
+            if "ETag" in cached.headers:
+                headers["If-None-Match"] = cached.headers["ETag"]
+            if "Last-Modified" in cached.headers:
+                headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+            kwargs["headers"] = headers
+        resp = session.request(method, url, **kwargs)
+        if resp.status_code == 304 and cached is not None:
+            vprint("[*] Revalidated: {}.".format(url))
+            self._touch(key)
+            return cached
+        self.store(key, resp)
+        return resp
+
+    def get(self, session, url, **kwargs):
+        return self.request(session, "GET", url, **kwargs)
+
+    def post(self, session, url, **kwargs):
+        return self.request(session, "POST", url, **kwargs)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class NullCache(object):
+    def lookup(self, key):
+        return None
+
+    def store(self, key, resp):
+        pass
+
+    def get(self, session, url, **kwargs):
+        return session.get(url, **kwargs)
+
+    def post(self, session, url, **kwargs):
+        return session.post(url, **kwargs)
+
+    def close(self):
+        pass
+
+
+def create_cache(config):
+    path = getattr(config, "cache", None)
+    if path:
+        return PageCache(path, getattr(config, "cache_ttl", 3600))
+    return NullCache()
+
+
+def get_cache():
+    # Returns the shared page cache, a pass-through one if caching is off.
+    return utils.get_runtime().part("cache", create_cache,
+                                    lambda cache: cache.close())
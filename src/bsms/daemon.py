@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# brightspace and mediasite download daemon
+# Copyright (c) 2018 Jan Jancar <johny@neuromancer.sk>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Takes lecture and course jobs from a queue directory and downloads them with
+# warm sessions, connection pools and page cache. A job is a JSON file in the
+# queue directory, named *.json:
+#
+#   {"platform": "mediasite", "kind": "course", "url": "...", "output": "..."}
+#
+# Write it under another name and rename it into place, so that it is never
+# picked up half written. It is renamed to *.json.running while downloaded
+# and to *.json.done or *.json.failed afterwards.
+
+import json
+import os
+import signal
+import threading
+from argparse import ArgumentParser
+from os.path import join
+
+from downloader import Downloader, add_options
+from scheduler import Scheduler
+
+JOB_SUFFIX = ".json"
+RUNNING_SUFFIX = ".running"
+DONE_SUFFIX = ".done"
+FAILED_SUFFIX = ".failed"
+DAEMON_OPTIONS = ("queue", "poll", "cookies", "output_root")
+
+
+def requeue(queue):
+    # A queue is served by one daemon, jobs left running by a previous one go
+    # back into the queue.
+    for name in os.listdir(queue):
+        if name.endswith(JOB_SUFFIX + RUNNING_SUFFIX):
+            os.replace(join(queue, name),
+                       join(queue, name[:-len(RUNNING_SUFFIX)]))
+
+
+def claim(queue, limit):
+    # Takes up to limit jobs in name order, renaming them so that they are
+    # not taken again.
+    claimed = []
+    for name in sorted(os.listdir(queue)):
+        if len(claimed) >= limit:
+            break
+        if not name.endswith(JOB_SUFFIX):
+            continue
+        path = join(queue, name)
+        try:
+            os.replace(path, path + RUNNING_SUFFIX)
+        except FileNotFoundError:
+            continue
+        claimed.append(path + RUNNING_SUFFIX)
+    return claimed
+
+
+def run_job(downloader, path):
+    try:
+        with open(path) as f:
+            job = json.load(f)
+        ok = downloader.download(job)
+    except Exception as e:
+        print("[!] Job {} failed: {}.".format(path, e))
+        ok = False
+    done = path[:-len(RUNNING_SUFFIX)]
+    done += DONE_SUFFIX if ok else FAILED_SUFFIX
+    os.replace(path, done)
+    print("[*] Job finished: {}.".format(done))
+    return ok
+
+
+def read_cookies(specs):
+    cookies = {}
+    for spec in specs:
+        platform, _, fname = spec.partition("=")
+        with open(fname) as f:
+            cookies[platform] = f.read().strip()
+    return cookies
+
+
+def main():
+    parser = ArgumentParser("daemon.py",
+                            description="Brightspace and Mediasite download daemon.",
+                            epilog="Licensed under MIT license. Copyright (C) 2018 Jan Jancar")
+    parser.add_argument("--poll", dest="poll", type=float, default=2.0,
+                        help="Seconds between looks into the queue.")
+    parser.add_argument("--cookies", dest="cookies", action="append",
+                        default=[], metavar="PLATFORM=FILE",
+                        help="Read the session cookies of a platform from a file.")
+    parser.add_argument("--output-root", dest="output_root", default=".",
+                        help="Directory the job outputs are relative to.")
+    add_options(parser)
+    parser.add_argument("queue", type=str,
+                        help="Directory of job files.")
+    config = parser.parse_args()
+
+    options = {key: value for key, value in vars(config).items()
+               if key not in DAEMON_OPTIONS}
+    if options["cache"] is None:
+        # Pages are still shared between jobs, just not kept on disk.
+        options["cache"] = ":memory:"
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    with Downloader(read_cookies(config.cookies), config.output_root,
+                    **options) as downloader, \
+            Scheduler(config.jobs) as scheduler:
+        requeue(config.queue)
+        print("[*] Watching {}.".format(config.queue))
+        try:
+            while not stop.is_set():
+                free = config.jobs - scheduler.running()
+                for path in claim(config.queue, free):
+                    print("[ ] Job: {}.".format(path))
+                    scheduler.submit(run_job, downloader, path)
+                stop.wait(config.poll)
+        except KeyboardInterrupt:
+            pass
+        print("[ ] Waiting for running jobs.")
+    print("[*] Done!")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,185 @@
+import argparse
+import threading
+from os import makedirs
+from os.path import dirname, join
+
+from requests.adapters import HTTPAdapter
+
+import brightspace
+import mediasite
+import utils
+from plan import write_plan
+from scheduler import lecture_slot
+from utils import create_session, get_user_agent
+
+PLATFORMS = {"brightspace": brightspace, "mediasite": mediasite}
+KINDS = ("lecture", "course")
+
+_runtime = None
+_users = 0
+_config_lock = threading.Lock()
+
+
+def add_options(parser):
+    # The options of both tools.
+    utils.add_common_options(parser)
+    mediasite.add_platform_options(parser)
+
+
+def default_config(**options):
+    # The command line defaults of both tools, with options overriding them.
+    parser = argparse.ArgumentParser(add_help=False)
+    add_options(parser)
+    config = parser.parse_args([])
+    unknown = set(options) - set(vars(config))
+    if unknown:
+        raise ValueError("Unknown options: {}.".format(
+                ", ".join(sorted(unknown))))
+    vars(config).update(options)
+    return config
+
+
+def open_runtime(config):
+    # The download code reads its configuration from the modules, so one
+    # runtime is installed at a time. Downloaders open together share it and
+    # have to be created with the same options, the last one closed closes
+    # its cache, limiter, store, transport, metrics and pools.
+    global _runtime, _users
+    with _config_lock:
+        if _runtime is not None:
+            installed = _runtime.config
+            if vars(installed) != vars(config):
+                differing = sorted(key for key in vars(config)
+                                   if vars(config)[key]
+                                   != vars(installed).get(key))
+                raise ValueError("Options differ from those of the open "
+                                 "downloader: {}.".format(
+                                         ", ".join(differing)))
+            _users += 1
+            return _runtime
+        _runtime = utils.Runtime(config)
+        _users = 1
+        utils.install_runtime(_runtime)
+        for module in PLATFORMS.values():
+            module.config = config
+        return _runtime
+
+
+def close_runtime(runtime):
+    global _runtime, _users
+    with _config_lock:
+        if runtime is not _runtime:
+            return
+        _users -= 1
+        if _users:
+            return
+        _runtime = None
+        utils.install_runtime(None)
+    runtime.close()
+
+
+def get_platform(platform):
+    try:
+        return PLATFORMS[platform]
+    except KeyError:
+        raise ValueError("Unknown platform: {}.".format(platform))
+
+
+def job_cookies(job):
+    # The cookies of a job, given inline or in a file, None for the
+    # downloader's cookies of the platform.
+    if job.get("cookies") is not None:
+        return job["cookies"]
+    if job.get("cookies_file") is not None:
+        with open(job["cookies_file"]) as f:
+            return f.read().strip()
+    return None
+
+
+class Downloader(object):
+    # Library access to both downloaders. Sessions are created once per
+    # platform and cookies and reused by all downloads, as are the transport,
+    # page cache and limiter. All sessions share one connection pool per host.
+    # The outputs of jobs are relative to the output root, if given, and so
+    # are the outputs of the lectures it plans.
+    # The downloader owns the runtime of its options and closes it, with the
+    # sessions, when closed. Downloaders open at once share the runtime and
+    # have to be created with the same options.
+    def __init__(self, cookies=None, output_root=None, **options):
+        self.config = default_config(**options)
+        self.config.output_root = output_root
+        self.runtime = open_runtime(self.config)
+        self.cookies = dict(cookies or {})
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.adapter = HTTPAdapter(
+                pool_maxsize=self.config.connections_per_host)
+
+    def session(self, platform, cookies=None):
+        get_platform(platform)
+        if cookies is None:
+            cookies = self.cookies.get(platform)
+        with self.lock:
+            session = self.sessions.get((platform, cookies))
+            if session is None:
+                session = create_session(cookies)
+                session.headers.update(get_user_agent())
+                session.mount("https://", self.adapter)
+                session.mount("http://", self.adapter)
+                self.sessions[(platform, cookies)] = session
+            return session
+
+    def download_lecture(self, platform, url, output, files=None,
+                         cookies=None):
+        with lecture_slot():
+            return get_platform(platform).download_lecture(
+                    url, output, self.session(platform, cookies), files)
+
+    def download_planned(self, lecture, files=None, cookies=None):
+        # A lecture of a plan, downloaded without scraping.
+        platform = lecture["platform"]
+        if dirname(lecture["output"]):
+            makedirs(dirname(lecture["output"]), exist_ok=True)
+        with lecture_slot():
+            return get_platform(platform).download_planned(
+                    lecture, self.session(platform, cookies), files)
+
+    def download_course(self, platform, url, output, cookies=None):
+        return get_platform(platform).download_course(
+                url, output, self.session(platform, cookies))
+
+    def download(self, job):
+        # A job is a dict with the platform, its kind, the url and output,
+        # and optionally its own cookies or cookies file. A lecture of a plan
+        # is a job with its streams.
+        kind = job.get("kind", "lecture")
+        if kind not in KINDS:
+            raise ValueError("Unknown job kind: {}.".format(kind))
+        if self.config.output_root:
+            job = dict(job, output=join(self.config.output_root,
+                                        job["output"]))
+        if "streams" in job:
+            return self.download_planned(job, cookies=job_cookies(job))
+        if kind == "course":
+            return self.download_course(job["platform"], job["url"],
+                                        job["output"], job_cookies(job))
+        return self.download_lecture(job["platform"], job["url"],
+                                     job["output"],
+                                     cookies=job_cookies(job))
+
+    def close(self):
+        with self.lock:
+            sessions, self.sessions = self.sessions, {}
+            runtime, self.runtime = self.runtime, None
+        if runtime is not None:
+            write_plan()
+        for session in sessions.values():
+            session.close()
+        if runtime is not None:
+            close_runtime(runtime)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
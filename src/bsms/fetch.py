@@ -0,0 +1,183 @@
+import random
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+import utils
+from ratelimit import limited_get, limited_read
+from store import get_store
+
+# Failed fetches are retried after this long, doubling with every attempt up
+# to the maximum, with some jitter so that workers do not retry in lockstep.
+RETRY_BASE = 0.5
+RETRY_MAX = 30.0
+# A fetch is hedged once it takes the hedge factor times the running median
+# of the track's fetch times, but never sooner than the minimum delay and only
+# once there are enough samples to tell what is slow.
+LATENCY_SAMPLES = 64
+HEDGE_MIN_SAMPLES = 8
+HEDGE_MIN_DELAY = 0.5
+HEDGE_WORKERS = 64
+
+
+class FetchError(IOError):
+    pass
+
+
+def get_timeout():
+    return getattr(utils.config, "timeout", 30)
+
+
+def get_retries():
+    return getattr(utils.config, "retries", 5)
+
+
+def check_status(status, expected=200):
+    if status != expected:
+        raise FetchError("Got status {}.".format(status))
+
+
+def check_length(headers, got):
+    # The length is that of the encoded body, which is not what was read if
+    # the body got decompressed.
+    length = headers.get("content-length")
+    if length is None or headers.get("content-encoding"):
+        return
+    if int(length) != got:
+        raise FetchError("Got {} of {} bytes.".format(got, length))
+
+
+def retry_delay(attempt):
+    return min(RETRY_BASE * 2 ** attempt, RETRY_MAX) * random.uniform(0.5, 1)
+
+
+class Latency(object):
+    # Running median of the fetch times of one track.
+    def __init__(self):
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def hedge_delay(self):
+        # How long to wait for a fetch before sending a duplicate, None if it
+        # should not be hedged.
+        factor = getattr(utils.config, "hedge_factor", 3.0)
+        with self.lock:
+            if not factor or len(self.samples) < HEDGE_MIN_SAMPLES:
+                return None
+            median = statistics.median(self.samples)
+        return max(median * factor, HEDGE_MIN_DELAY)
+
+
+def record_fetch(spool, elapsed, latency=None, stats=None):
+    if latency is not None:
+        latency.add(elapsed)
+    if stats is not None:
+        stats.observe(elapsed)
+        stats.add("bytes", spool.tell())
+
+
+def get_hedge_executor():
+    return utils.get_runtime().part(
+            "hedge", lambda config: ThreadPoolExecutor(
+                    max_workers=HEDGE_WORKERS, thread_name_prefix="bsms-hedge"),
+            lambda executor: executor.shutdown(wait=False))
+
+
+def fetch_once(session, url, params=None, cancel=None):
+    spool = utils.new_spool()
+    try:
+        with limited_get(session, url, params=params, stream=True,
+                         timeout=get_timeout()) as resp:
+            check_status(resp.status_code)
+            got = 0
+            for chunk in limited_read(resp.iter_content(
+                    chunk_size=utils.CHUNK_SIZE)):
+                if cancel is not None and cancel.is_set():
+                    raise FetchError("Cancelled.")
+                spool.write(chunk)
+                got += len(chunk)
+            check_length(resp.headers, got)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+def discard(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def fetch_hedged(session, url, params, delay, stats=None):
+    # Runs the fetch in the hedge pool and sends a duplicate if it is not done
+    # after delay, the first good response wins and the other is dropped.
+    executor = get_hedge_executor()
+    cancel = threading.Event()
+    futures = [executor.submit(fetch_once, session, url, params, cancel)]
+    if not wait(futures, timeout=delay).done:
+        utils.vprint("[ ] Hedging slow fetch of {}.".format(url))
+        if stats is not None:
+            stats.add("hedges")
+        futures.append(executor.submit(fetch_once, session, url, params,
+                                       cancel))
+    error = None
+    while futures:
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            futures.remove(future)
+            if future.exception() is None and not cancel.is_set():
+                cancel.set()
+                winner = future
+            elif future.exception() is None:
+                future.result().close()
+            else:
+                error = error or future.exception()
+        if cancel.is_set():
+            for future in futures:
+                future.add_done_callback(discard)
+            return winner.result()
+    raise error
+
+
+def fetch_segment(session, url, params=None, latency=None, stats=None):
+    # Fetches a segment into a spool, with timeouts, validation of the status
+    # and length, hedging of slow fetches and retries of failed ones. Segments
+    # in the store are not fetched at all.
+    store = get_store()
+    if store is not None:
+        stored = store.open(url)
+        if stored is not None:
+            if stats is not None:
+                stats.add("stored")
+            return stored
+    retries = get_retries()
+    for attempt in range(retries + 1):
+        start = time.monotonic()
+        delay = latency.hedge_delay() if latency is not None else None
+        try:
+            if delay is None:
+                spool = fetch_once(session, url, params)
+            else:
+                spool = fetch_hedged(session, url, params, delay, stats)
+        except (requests.RequestException, FetchError) as e:
+            if attempt == retries:
+                raise
+            if stats is not None:
+                stats.add("retries")
+            wait_time = retry_delay(attempt)
+            utils.vprint("[!] Fetching {} failed: {} Retrying in {:.1f}s."
+                         .format(url, e, wait_time))
+            time.sleep(wait_time)
+            continue
+        record_fetch(spool, time.monotonic() - start, latency, stats)
+        if store is not None:
+            store.add(url, spool)
+        return spool
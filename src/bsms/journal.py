@@ -0,0 +1,117 @@
+import json
+import threading
+from os import remove, replace
+from os.path import exists, getsize
+
+import utils
+from utils import Track, download_tracks
+
+
+class SegmentJournal(object):
+    # Sidecar journal of the segments already written to a partial file, one
+    # JSON object per line with the segment index, offset and size.
+    def __init__(self, path):
+        self.path = path
+        self.completed = {}
+        if exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash.
+                        break
+                    self.completed[entry["index"]] = (entry["offset"],
+                                                      entry["size"])
+        self.file = open(path, "a")
+        self.lock = threading.Lock()
+
+    def record(self, index, offset, size):
+        with self.lock:
+            self.completed[index] = (offset, size)
+            self.file.write(json.dumps({"index": index, "offset": offset,
+                                        "size": size}) + "\n")
+            self.file.flush()
+
+    def resume_point(self, available):
+        # Returns the number of leading segments that are complete and the
+        # offset they end at, only counting data actually in the file.
+        count = 0
+        end = 0
+        while count in self.completed:
+            offset, size = self.completed[count]
+            if offset != end or offset + size > available:
+                break
+            end = offset + size
+            count += 1
+        return count, end
+
+    def close(self):
+        self.file.close()
+
+    def remove(self):
+        self.close()
+        if exists(self.path):
+            remove(self.path)
+
+
+def part_name(out_fname):
+    return out_fname + ".part"
+
+
+def journal_name(out_fname):
+    return out_fname + ".journal"
+
+
+def open_resumable(urls, out_fname, stats=None):
+    # Opens the .part file next to out_fname and its journal, returns a track
+    # of the segments that are still missing.
+    part_fname = part_name(out_fname)
+    journal = SegmentJournal(journal_name(out_fname))
+    available = getsize(part_fname) if exists(part_fname) else 0
+    count, offset = journal.resume_point(available)
+    if count:
+        print("[*] Resuming {} after {} segments.".format(out_fname, count))
+    out = open(part_fname, "r+b" if available else "wb")
+    out.truncate(offset)
+    out.seek(offset)
+    return Track(urls[count:], out, journal, count, stats=stats)
+
+
+def finish_resumable(track, out_fname):
+    track.out.close()
+    track.journal.close()
+    replace(part_name(out_fname), out_fname)
+    track.journal.remove()
+
+
+def download_tracks_resumable(session, tracks, stats=None, **kwargs):
+    # Download each (urls, out_fname) track into a .part file next to
+    # out_fname, recording segments in a journal so that a rerun only fetches
+    # the missing ones. Files are renamed to out_fname once complete.
+    tracks = [(urls, out_fname) for urls, out_fname in tracks
+              if not exists(out_fname)]
+    if getattr(utils.config, "preallocate", False):
+        # Tracks whose segment sizes are known are written into place.
+        from ranged import download_sized
+        tracks = [(urls, out_fname) for urls, out_fname in tracks
+                  if not download_sized(session, urls, out_fname,
+                                        kwargs.get("params"),
+                                        kwargs.get("max_workers", 4), stats)]
+    if not tracks:
+        return
+    opened = [open_resumable(urls, out_fname, stats)
+              for urls, out_fname in tracks]
+    try:
+        download_tracks(session, opened, **kwargs)
+    except BaseException:
+        for track in opened:
+            track.out.close()
+            track.journal.close()
+        raise
+    for track, (_, out_fname) in zip(opened, tracks):
+        finish_resumable(track, out_fname)
+
+
+def download_segments_resumable(session, urls, out_fname, **kwargs):
+    download_tracks_resumable(session, [(urls, out_fname)], **kwargs)
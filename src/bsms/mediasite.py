@@ -23,30 +23,41 @@
 
 
 import argparse
-import m3u8
 import re
 import requests
-import subprocess
-import tempfile
-from PIL import Image
-from bs4 import BeautifulSoup
-from fpdf import FPDF
-from io import BytesIO
-from os import makedirs
-from os.path import join, exists
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from os import makedirs, remove, replace
+from os.path import join, exists, getsize
 from urllib.parse import urlparse, parse_qs
 
+import scrape
 import utils
-from utils import vprint, get_user_agent, get_url_root, download_segments, create_session
+from cache import get_cache
+from scheduler import Scheduler
+from sync import SyncManifest, fingerprint, sync_lecture
+from metrics import get_metrics
+from journal import download_tracks_resumable, part_name, journal_name
+from ranged import download_ranged
+from store import store_output
+from postprocess import run_cpu
+from plan import planning, add_lecture, get_lecture_jobs, write_plan
+from fetch import (FetchError, Latency, check_length, check_status,
+                   fetch_segment, get_timeout)
+from ratelimit import limited_get, limited_read
+from variants import select_variant, select_media, playlist_duration, max_size_bytes
+from utils import vprint, get_user_agent, get_url_root, create_session, parse_playlist, ordered_map, download_tracks, Track, add_common_options
+
+LISTING_WORKERS = 4
+unsatisfied_range_re = re.compile(r"bytes \*/(\d+)")
 
 
 def get_player_options(vid_url, session):
     vprint("[ ] Getting player options.")
-    vid_page = session.get(vid_url)
-    vid_soup = BeautifulSoup(vid_page.text, "lxml")
-    global_data = vid_soup.find(id="GlobalData")
-    res_id = global_data.find(id="ResourceId").string
-    service_path = global_data.find(id="ServicePath").string
+    pages = get_cache()
+    vid_page = pages.get(session, vid_url)
+    res_id, service_path = scrape.global_data(vid_page.text, "ResourceId",
+                                              "ServicePath")
 
     req_content = {"getPlayerOptionsRequest": {
         "QueryString": urlparse(vid_url).query,
@@ -57,7 +68,7 @@ def get_player_options(vid_url, session):
     }
     get_options_svc = get_url_root(
             vid_url) + service_path + "/GetPlayerOptions"
-    player_options = session.post(get_options_svc, json=req_content)
+    player_options = pages.post(session, get_options_svc, json=req_content)
     result = player_options.json()
     vprint("[*] Got them.")
     return result
@@ -82,27 +93,42 @@ def get_stream_location(stream):
         return result
 
 
-def get_manifests(url, session):
+def get_manifests(url, session, params=None):
     vprint("[ ] Getting main manifest.")
-    manifest = session.get(url)
+    manifest = get_cache().get(session, url, params=params)
     vprint("[*] Got it.")
-    playlist = m3u8.loads(manifest.text)
-
-    audio_manifest = playlist.playlists[0].uri
-    video_manifest = playlist.media[0].uri
+    playlist = parse_playlist(manifest.text)
+
+    def get_duration():
+        variant_manifest = get_cache().get(
+                session, url[:url.rfind("/")] + "/" + playlist.playlists[0].uri,
+                params=params)
+        return playlist_duration(parse_playlist(variant_manifest.text))
+
+    variant = select_variant(playlist.playlists, config.quality,
+                             config.max_bitrate,
+                             max_size_bytes(config.max_size), get_duration)
+    audio_manifest = variant.uri
+    video_manifest = select_media(playlist.media, variant).uri
     vprint("[*] Got manifests: {}, {}.".format(audio_manifest, video_manifest))
     return audio_manifest, video_manifest
 
 
-def get_segments(video_base, manifest_name, session):
+def get_segments(video_base, manifest_name, session, params=None):
     vprint("[ ] Getting segments for: {}.".format(manifest_name))
-    manifest = session.get(video_base + "/" + manifest_name)
-    playlist = m3u8.loads(manifest.text)
-
-    segments = [playlist.segment_map["uri"]] + [segment.uri for segment in
-                                                playlist.segments]
+    manifest = get_cache().get(session, video_base + "/" + manifest_name,
+                               params=params)
+    playlist = parse_playlist(manifest.text)
+
+    segment_map = playlist.segment_map
+    if isinstance(segment_map, list):
+        # Newer m3u8 versions keep a list of initialization sections.
+        init_uri = segment_map[0].uri
+    else:
+        init_uri = segment_map["uri"]
+    segments = [init_uri] + [segment.uri for segment in playlist.segments]
     vprint("[*] Got segments.")
-    return segments
+    return segments, playlist_duration(playlist)
 
 
 def get_out_fname(type, base):
@@ -113,7 +139,7 @@ def get_out_fname(type, base):
     return None
 
 
-def download_slide_stream(url, other, session, out_fname):
+def get_slide_urls(url, other):
     total = other[2]
     template = other[3]
 
@@ -122,189 +148,421 @@ def download_slide_stream(url, other, session, out_fname):
 
     template_prefix, _, template_suffix = template_re.split(template)
 
-    slide_files = []
-    max_w = 0
-    max_h = 0
-    for i in range(total):
-        slide_name = template_prefix + ("{:0" + str(width) + "d}").format(
-                i + 1) + template_suffix
-        slide_url = url + slide_name
+    return [url + template_prefix + ("{:0" + str(width) + "d}").format(
+            i + 1) + template_suffix for i in range(total)]
+
+
+def download_slide_stream(slide_urls, session, out_fname, stats):
+    from pdf import StreamingPDF, decoded_info, header_info
+    latency = Latency()
+
+    def fetch_slide(slide_url):
         vprint("[ ] Downloading slide: {}.".format(slide_url))
-        slide = session.get(slide_url)
-        img = Image.open(BytesIO(slide.content))
-        w, h = img.size
-        if w > max_w:
-            max_w = w
-        if h > max_h:
-            max_h = h
-
-        slide_file = tempfile.NamedTemporaryFile(suffix=slide_name)
-        slide_file.write(slide.content)
-        slide_files.append(slide_file)
-
-    vprint("[ ] Combining pdf.")
-    pdf = FPDF("P", "pt", (max_w, max_h))
-    for image in slide_files:
-        pdf.add_page()
-        pdf.image(image.name, 0, 0)
-        image.close()
-    vprint("[*] Combined.")
+        with fetch_segment(session, slide_url, latency=latency,
+                           stats=stats) as slide:
+            slide.seek(0)
+            data = slide.read()
+        # Images that have to be decoded are, in the post-processing pool.
+        return header_info(data) or run_cpu(decoded_info, data)
+
+    # Slides are fetched in parallel and added to the pdf in order as they
+    # arrive, only the ones in the reorder window are held in memory.
     vprint("[ ] Writing pdf.")
-    pdf.output(out_fname, "F")
+    part_fname = part_name(out_fname)
+    stats.expect("segments", len(slide_urls))
+    with ThreadPoolExecutor(max_workers=config.segment_workers) as executor, \
+            open(part_fname, "wb") as pdf_file, stats.phase("fetch"):
+        pdf = StreamingPDF(pdf_file)
+        for info in ordered_map(executor, fetch_slide, slide_urls,
+                                config.segment_window):
+            pdf.add_image_page(info)
+            stats.add("segments")
+        pdf.close()
+    replace(part_fname, out_fname)
     vprint("[*] Wrote.")
 
 
-def download_segmented_stream(url, params, other, session, out_fname):
-    session.params = params
-    audio_manifest, video_manifest = get_manifests(url, session)
-    vid_url = url[:url.rfind("/")]
-    audio_segments = get_segments(vid_url, audio_manifest, session)
-    video_segments = get_segments(vid_url, video_manifest, session)
-    with tempfile.NamedTemporaryFile() as aud_file, tempfile.NamedTemporaryFile() as vid_file:
-        vprint(
-                "[ ] Downloading video segments({})".format(
-                        len(video_segments)))
-        download_segments(session,
-                          (vid_url + "/" + vid_segment for vid_segment in
-                           video_segments), vid_file)
-        vprint(
-                "[ ] Downloading audio segments({}).".format(
-                        len(audio_segments)))
-        download_segments(session,
-                          (vid_url + "/" + aud_segment for aud_segment in
-                           audio_segments), aud_file)
-        aud_file.flush()
-        vid_file.flush()
+def download_segmented_stream(aud_urls, vid_urls, params, session, out_fname,
+                              stats):
+    from mux import can_pipe, join_files, join_streams
+    part_fname = part_name(out_fname)
+    if config.mux == "pipe" and can_pipe():
+        # Both tracks are downloaded at once straight into ffmpeg, this can
+        # not be resumed as the tracks never touch the disk.
+        vprint("[ ] Downloading audio({}) and video({}) segments into {}.".format(
+                len(aud_urls), len(vid_urls), out_fname))
+
+        def feed(writers):
+            download_tracks(session, [Track(urls, writer, close=True,
+                                            stats=stats)
+                                      for urls, writer in
+                                      zip((aud_urls, vid_urls), writers)],
+                            max_workers=config.segment_workers,
+                            window=config.segment_window, params=params)
+
+        # Muxing runs alongside, the time is all counted as fetching.
+        with stats.phase("fetch"):
+            ok = join_streams(feed, 2, part_fname)
+    else:
+        # The tracks are kept next to the output until joined, so that an
+        # interrupted download can be resumed.
+        aud_fname = out_fname + ".audio"
+        vid_fname = out_fname + ".video"
+        vprint("[ ] Downloading audio({}) and video({}) segments.".format(
+                len(aud_urls), len(vid_urls)))
+        with stats.phase("fetch"):
+            download_tracks_resumable(session, [(aud_urls, aud_fname),
+                                                (vid_urls, vid_fname)],
+                                      stats=stats,
+                                      max_workers=config.segment_workers,
+                                      window=config.segment_window,
+                                      params=params)
         vprint("[ ] Joining into {}.".format(out_fname))
-        subprocess.call(
-                ["ffmpeg", "-i", aud_file.name, "-i", vid_file.name, "-c",
-                 "copy", out_fname])
-        vprint("[*] Joined to {}.".format(out_fname))
-
-
-def download_raw_stream(url, params, other, session, out_fname):
-    req = session.get(url, params=params, stream=True)
-    vprint("[ ] {}.".format(url))
-    total = int(req.headers.get("content-length"))
-    got = 0
-    with open(out_fname, "wb") as out_file:
-        for chunk in req.iter_content(chunk_size=1024):
-            if chunk:
-                out_file.write(chunk)
-                if total is not None:
-                    amount = ((got * 50) // total)
-                    vprint("[{:50}]".format("#" * amount), end="\r")
-                    got = got + len(chunk)
-    if total is not None:
-        vprint()
-
-
-def download_stream(location, type, other, session, out_file):
-    vprint(
-            "[ ] Downloading stream({}), {}: {}.".format(type, out_file,
-                                                         location))
+        with stats.phase("mux"):
+            ok = join_files([aud_fname, vid_fname], part_fname)
+        if ok:
+            remove(aud_fname)
+            remove(vid_fname)
+    if not ok:
+        print("[!] Joining into {} failed.".format(out_fname))
+        return
+    replace(part_fname, out_fname)
+    vprint("[*] Joined to {}.".format(out_fname))
+
+
+def download_raw_stream(url, params, session, out_fname, stats):
+    part_fname = part_name(out_fname)
+    journal_fname = journal_name(out_fname)
+    # Prefer several ranged connections, unless a single connection download
+    # is already partially done. A ranged partial is preallocated to the full
+    # size, so it is only resumed by ranges, whatever the connection count.
+    if exists(journal_fname) or (config.raw_connections > 1 and
+                                 not exists(part_fname)):
+        with stats.phase("fetch"):
+            done = download_ranged(session, url, out_fname, params,
+                                   max(config.raw_connections, 1),
+                                   stats=stats)
+        if done:
+            return
+        vprint("[*] No range support, using a single connection.")
+        if exists(journal_fname):
+            # The size of a ranged partial tells nothing, start over.
+            for fname in (part_fname, journal_fname):
+                if exists(fname):
+                    remove(fname)
+    # Continue a partial download with a Range request if there is one.
+    got = getsize(part_fname) if exists(part_fname) else 0
+    headers = {"Range": "bytes={}-".format(got)} if got else None
+    with limited_get(session, url, params=params, headers=headers,
+                     stream=True, timeout=get_timeout()) as req:
+        vprint("[ ] {}.".format(url))
+        if got and req.status_code == 416:
+            # Nothing left to download if the partial is the whole resource,
+            # the rename did not happen.
+            match = unsatisfied_range_re.match(
+                    req.headers.get("content-range", ""))
+            if match is None or int(match.group(1)) != got:
+                remove(part_fname)
+                raise FetchError("Partial download of {} does not match, "
+                                 "starting over.".format(out_fname))
+            replace(part_fname, out_fname)
+            return
+        if got and req.status_code == 206:
+            print("[*] Resuming at {} bytes.".format(got))
+        else:
+            check_status(req.status_code)
+            got = 0
+        total = req.headers.get("content-length")
+        if total is not None:
+            stats.expect("bytes", int(total))
+        written = 0
+        with open(part_fname, "ab" if got else "wb") as out_file, \
+                stats.phase("fetch"):
+            for chunk in limited_read(req.iter_content(
+                    chunk_size=utils.CHUNK_SIZE)):
+                if chunk:
+                    out_file.write(chunk)
+                    written += len(chunk)
+                    stats.add("bytes", len(chunk))
+        # A short body stays partial, to be resumed.
+        check_length(req.headers, written)
+    replace(part_fname, out_fname)
+
+
+def resolve_stream(location, type, other, session, suffix):
+    # Scrapes a stream down to the urls of its tracks, as a stream of a plan.
     parsed = urlparse(location)
     params = parse_qs(parsed.query)
     parsed._replace(query="")
     url = parsed.geturl()
 
-    out_fname = get_out_fname(type, out_file)
-    if out_fname is None:
-        print("[!] Bad type, no out_fname.")
-        return
+    stream = {"type": type, "suffix": suffix, "params": params,
+              "duration": None}
+    if type == "manifest_mp4":
+        # The session is shared between lectures, so pass params per request.
+        audio_manifest, video_manifest = get_manifests(url, session, params)
+        vid_url = url[:url.rfind("/")]
+        tracks = []
+        for manifest_name in (audio_manifest, video_manifest):
+            segments, duration = get_segments(vid_url, manifest_name, session,
+                                              params)
+            tracks.append([vid_url + "/" + segment for segment in segments])
+            stream["duration"] = max(stream["duration"] or 0, duration)
+        stream["tracks"] = tracks
+    elif type == "raw_mp4":
+        stream["tracks"] = [[url]]
+    elif type == "slides":
+        stream["params"] = None
+        stream["tracks"] = [get_slide_urls(url, other)]
+    return stream
+
+
+def download_resolved(stream, output_name, session, lecture=None,
+                      stats=None):
+    # Downloads a resolved stream into the output name with its suffix.
+    type = stream["type"]
+    out_fname = output_name + stream["suffix"]
     if exists(out_fname):
         print(
                 "[*] Skipping stream({}), because file already exists: {}.".format(
                         type, out_fname))
-        return
+        return out_fname
 
+    if stats is None:
+        stats = get_metrics().get(lecture or output_name, out_fname)
+    tracks = stream["tracks"]
+    params = stream["params"]
     if type == "manifest_mp4":
-        download_segmented_stream(url, params, other, session, out_fname)
+        download_segmented_stream(tracks[0], tracks[1], params, session,
+                                  out_fname, stats)
     elif type == "raw_mp4":
-        download_raw_stream(url, params, other, session, out_fname)
+        download_raw_stream(tracks[0][0], params, session, out_fname, stats)
     elif type == "slides":
-        download_slide_stream(url, other, session, out_fname)
+        download_slide_stream(tracks[0], session, out_fname, stats)
+    if not exists(out_fname):
+        return None
+    store_output(out_fname)
+    return out_fname
+
+
+def download_stream(location, type, other, session, out_file, lecture=None):
+    vprint(
+            "[ ] Downloading stream({}), {}: {}.".format(type, out_file,
+                                                         location))
+    suffix = get_out_fname(type, "")
+    if suffix is None:
+        print("[!] Bad type, no out_fname.")
+        return None
+    out_fname = out_file + suffix
+    if exists(out_fname):
+        print(
+                "[*] Skipping stream({}), because file already exists: {}.".format(
+                        type, out_fname))
+        return out_fname
+
+    stats = get_metrics().get(lecture or out_file, out_fname)
+    with stats.phase("scrape"):
+        stream = resolve_stream(location, type, other, session, suffix)
+    return download_resolved(stream, out_file, session, lecture, stats)
+
+
+def download_streams(downloads, files=None):
+    # The streams of a lecture are downloaded concurrently, segmented ones
+    # share the segment engine and its connection pool. A download is the
+    # type of the stream and a function returning its output file, None if
+    # it failed. Returns whether all streams produced their output, failed
+    # ones are listed in files without a file name.
+    ok = True
+    with ThreadPoolExecutor(max_workers=max(len(downloads), 1)) as executor:
+        futures = [(type, executor.submit(download))
+                   for type, download in downloads]
+        for type, future in futures:
+            out_fname = future.result()
+            if out_fname is None:
+                ok = False
+            if files is not None:
+                files.append((out_fname, type))
+    return ok
+
+
+def plan_lecture(lecture_url, output_name, session, locations, duration):
+    # Resolves the streams of a lecture concurrently into the plan.
+    def resolve(i, stream_data):
+        suffix = get_out_fname(stream_data[1], "_" + str(i))
+        return resolve_stream(stream_data[0], stream_data[1], stream_data,
+                              session, suffix)
+
+    with ThreadPoolExecutor(max_workers=max(len(locations), 1)) as executor:
+        streams = list(executor.map(resolve, range(len(locations)),
+                                    locations))
+    add_lecture("mediasite", lecture_url, output_name, streams, session,
+                duration)
+    return True
 
 
-def download_lecture(lecture_url, output_name, session):
+def download_lecture(lecture_url, output_name, session, files=None):
     print("[ ] Downloading lecture: {} into {}.".format(lecture_url,
                                                         output_name))
-    opts = get_player_options(lecture_url, session)
-    streams = opts["d"]["Presentation"]["Streams"]
+    with get_metrics().get(output_name).phase("scrape"):
+        opts = get_player_options(lecture_url, session)
+    presentation = opts["d"]["Presentation"]
+    streams = presentation["Streams"]
     vprint("[*] Got {} streams.".format(str(len(streams))))
-    for i, stream in enumerate(streams):
+    locations = []
+    for stream in streams:
         stream_data = get_stream_location(stream)
-        print("[*] Stream: {}".format(stream_data[0]))
         if stream_data is None:
             print("[!] Cannot find stream to download!")
             return False
-        if config.dry_run:
-            print("[*] Skipping, because dry-run is enabled.")
-            continue
-        download_stream(stream_data[0], stream_data[1], stream_data,
-                        session, output_name + "_" + str(i))
+        print("[*] Stream: {}".format(stream_data[0]))
+        locations.append(stream_data)
+    if planning():
+        # The presentation tells its duration in milliseconds, for streams
+        # without a playlist.
+        duration = presentation.get("Duration")
+        return plan_lecture(lecture_url, output_name, session, locations,
+                            duration / 1000 if duration else None)
+    if config.dry_run:
+        print("[*] Skipping, because dry-run is enabled.")
+        return True
+    if not download_streams([(stream_data[1],
+                              partial(download_stream, stream_data[0],
+                                      stream_data[1], stream_data, session,
+                                      output_name + "_" + str(i),
+                                      output_name))
+                             for i, stream_data in enumerate(locations)],
+                            files):
+        print("[!] Some streams of the lecture failed.")
+        return False
     print("[*] Downloaded lecture.")
     return True
 
 
+def download_planned(lecture, session, files=None):
+    # Downloads a lecture of a plan, its streams are resolved already.
+    output_name = lecture["output"]
+    print("[ ] Downloading planned lecture: {} into {}.".format(
+            lecture["url"], output_name))
+    if not download_streams([(stream["type"],
+                              partial(download_resolved, stream, output_name,
+                                      session))
+                             for stream in lecture["streams"]], files):
+        print("[!] Some streams of the lecture failed.")
+        return False
+    print("[*] Downloaded lecture.")
+    return True
+
+
+def get_presentations_page(folders_url, catalog_id, page_index, page_size,
+                           session):
+    req_content = {
+        "IsViewPage": True,
+        "IsNewFolder": False,
+        "AuthTicket": None,
+        "CatalogId": catalog_id,
+        "CurrentFolderId": catalog_id,
+        "RootDynamicFolderId": None,
+        "ItemsPerPage": page_size,
+        "PageIndex": page_index,
+        "PermissionMask": "Execute",
+        "CatalogSearchType": "SearchInFolder",
+        "SortBy": "Date",
+        "SortDirection": "Descending",
+        "StartDate": None,
+        "EndDate": None,
+        "StatusFilterList": None,
+        "PreviewKey": None,
+        "Tags": []
+    }
+    vprint("[ ] Getting presentations page {}.".format(page_index))
+    page = get_cache().post(session, folders_url, json=req_content)
+    return page.json()
+
+
+def list_presentations(course_url, catalog_id, session, page_size=10):
+    # The first page tells the total, the rest are fetched concurrently.
+    # Returns the total and a generator of presentations as pages arrive.
+    folders_url = get_url_root(
+            course_url) + "/Mediasite/Catalog/Data/GetPresentationsForFolder"
+    first = get_presentations_page(folders_url, catalog_id, 0, page_size,
+                                   session)
+    total = first["TotalItems"]
+    page_count = -(-total // page_size)
+
+    def presentations():
+        for lecture in first["PresentationDetailsList"]:
+            yield lecture
+        if page_count <= 1:
+            return
+        with ThreadPoolExecutor(
+                max_workers=min(LISTING_WORKERS, page_count - 1)) as executor:
+            futures = [executor.submit(get_presentations_page, folders_url,
+                                       catalog_id, i, page_size, session)
+                       for i in range(1, page_count)]
+            for future in as_completed(futures):
+                for lecture in future.result()["PresentationDetailsList"]:
+                    yield lecture
+
+    return total, presentations()
+
+
 def download_course(course_url, output_name, session):
     print("[ ] Downloading course: {}.".format(course_url))
-    main_page = session.get(course_url)
-    main_soup = BeautifulSoup(main_page.text, "lxml")
-
-    main_form = main_soup.find(id="MainForm")
-    scripts = main_form.find_all("script")
-    catalog_id = None
-    catalog_id_re = re.compile(r"CatalogId: *'([a-f0-9\-]+?)'")
-    for script in scripts:
-        match = catalog_id_re.search(script.string)
-        if match:
-            catalog_id = match.group(1)
-
-    i = 0
-    lecture_urls = []
-    total = None
-    while len(lecture_urls) != total:
-        req_content = {
-            "IsViewPage": True,
-            "IsNewFolder": False,
-            "AuthTicket": None,
-            "CatalogId": catalog_id,
-            "CurrentFolderId": catalog_id,
-            "RootDynamicFolderId": None,
-            "ItemsPerPage": 10,
-            "PageIndex": i,
-            "PermissionMask": "Execute",
-            "CatalogSearchType": "SearchInFolder",
-            "SortBy": "Date",
-            "SortDirection": "Descending",
-            "StartDate": None,
-            "EndDate": None,
-            "StatusFilterList": None,
-            "PreviewKey": None,
-            "Tags": []
-        }
-        url = get_url_root(
-                course_url) + "/Mediasite/Catalog/Data/GetPresentationsForFolder"
-
-        page = session.post(url, json=req_content)
-        page_data = page.json()
-        if total is None:
-            total = page_data["TotalItems"]
-        for lecture in page_data["PresentationDetailsList"]:
-            lecture_urls.append((lecture["PlayerUrl"], lecture["Name"]))
-        i += 1
+    pages = get_cache()
+    main_page = pages.get(session, course_url)
+    catalog_id = scrape.catalog_id(main_page.text)
 
+    total, presentations = list_presentations(course_url, catalog_id, session,
+                                              config.page_size)
     print(
             "[ ] Downloading {} lectures into {}.".format(str(total),
                                                           output_name))
-    makedirs(output_name, exist_ok=True)
-    for lecture in reversed(lecture_urls):
-        fname = join(output_name, lecture[1])
-        if not download_lecture(lecture[0], fname, session):
-            return False
-    return True
-
+    if not planning():
+        makedirs(output_name, exist_ok=True)
+    # Lectures are handed to the scheduler while the listing is still being
+    # fetched.
+    lectures = ((lecture.get("Id", lecture["PlayerUrl"]),
+                 fingerprint(lecture), lecture["PlayerUrl"], lecture["Name"])
+                for lecture in presentations)
+    manifest = None
+    if config.sync:
+        manifest = SyncManifest(output_name)
+        lectures = manifest.changed(lectures)
+    with Scheduler(get_lecture_jobs(), capped=True) as scheduler:
+        for lecture_id, lecture_fingerprint, lecture_url, name in lectures:
+            fname = join(output_name, name)
+            if manifest is not None:
+                scheduler.submit(sync_lecture, manifest, lecture_id,
+                                 lecture_fingerprint, download_lecture,
+                                 lecture_url, fname, session,
+                                 config.dry_run or planning())
+            else:
+                scheduler.submit(download_lecture, lecture_url, fname,
+                                 session)
+        return scheduler.wait()
+
+
+def add_platform_options(parser):
+    # The options only Mediasite has.
+    parser.add_argument("--page-size", dest="page_size", type=int, default=10,
+                        help="Number of catalog entries requested per listing page.")
+    parser.add_argument("--mux", dest="mux", choices=["file", "pipe"],
+                        default="file",
+                        help="Join segmented streams from resumable track files, or feed ffmpeg through pipes while downloading.")
+    parser.add_argument("--muxer", dest="muxer",
+                        choices=["auto", "ffmpeg", "python"], default="auto",
+                        help="Join tracks with ffmpeg or the built-in fMP4 remuxer, auto uses ffmpeg if it is installed.")
+    parser.add_argument("--cpu-workers", dest="cpu_workers", type=int,
+                        help="Number of processes for CPU bound post-processing, remuxing and decoding slides, 0 to do it inline. Defaults to the number of CPUs, or inline with a single CPU.")
+    parser.add_argument("--raw-connections", dest="raw_connections", type=int,
+                        default=4,
+                        help="Number of connections to download raw MP4 streams over.")
+
+
+def add_options(parser):
+    # The options, shared by the command line and the library API.
+    add_common_options(parser)
+    add_platform_options(parser)
 
 def main():
     global config
@@ -316,10 +574,7 @@ def main():
                        help="A URL of a video/lecture to download.")
     group.add_argument("--catalog", "--course", dest="course_url",
                        help="A URL of a catalog/course to download all of its lectures.")
-    parser.add_argument("-n", "--dry-run", dest="dry_run", action="store_true",
-                        help="Do not download anything.")
-    parser.add_argument("-v", "--verbose", dest="verbose", action="store_true",
-                        help="Enable verbose output.")
+    add_options(parser)
     parser.add_argument("-a", "--auth", dest="auth", action="store_true",
                         help="Enable authentication, will ask for cookie jar.")
     parser.add_argument("output", type=str,
@@ -344,6 +599,7 @@ def main():
             if not download_course(config.course_url, config.output, session):
                 return 1
 
+    write_plan()
     print("[*] Done!")
     return 0
 
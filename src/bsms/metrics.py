@@ -0,0 +1,219 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+COUNTERS = ("bytes", "segments", "requests", "retries", "hedges", "stored")
+PHASES = ("scrape", "fetch", "mux")
+# Upper bounds of the request latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FORMATS = ("jsonl", "prometheus")
+
+
+class Stats(object):
+    # Counters of one stream of a lecture, or of the lecture itself if the
+    # stream is empty.
+    def __init__(self, lecture="", stream=""):
+        self.lecture = lecture
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.expected = {}
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+
+    def add(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def expect(self, name, amount):
+        # Announces how much of a counter is to come, for the progress.
+        with self.lock:
+            self.expected[name] = self.expected.get(name, 0) + amount
+
+    def observe(self, seconds):
+        with self.lock:
+            self.counters["requests"] += 1
+            self.latency_sum += seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    self.buckets[i] += 1
+                    break
+            else:
+                self.buckets[-1] += 1
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self.phases[phase] += seconds
+
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield self
+        finally:
+            self.add_time(name, time.monotonic() - start)
+
+    def snapshot(self):
+        with self.lock:
+            return {"lecture": self.lecture,
+                    "stream": self.stream,
+                    "counters": dict(self.counters),
+                    "expected": dict(self.expected),
+                    "latency": {"buckets": list(self.buckets),
+                                "sum": self.latency_sum},
+                    "phases": dict(self.phases)}
+
+
+def prometheus_labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"") \
+            .replace("\n", "\\n")
+
+    return "{" + ",".join("{}=\"{}\"".format(key, escape(value))
+                          for key, value in labels.items()) + "}"
+
+
+def prometheus_text(snapshots):
+    lines = []
+    for name in COUNTERS:
+        lines.append("# TYPE bsms_{}_total counter".format(name))
+        for snap in snapshots:
+            lines.append("bsms_{}_total{} {}".format(
+                    name, prometheus_labels(lecture=snap["lecture"],
+                                            stream=snap["stream"]),
+                    snap["counters"][name]))
+    lines.append("# TYPE bsms_expected gauge")
+    for snap in snapshots:
+        for name, value in sorted(snap["expected"].items()):
+            lines.append("bsms_expected{} {}".format(
+                    prometheus_labels(lecture=snap["lecture"],
+                                      stream=snap["stream"], counter=name),
+                    value))
+    lines.append("# TYPE bsms_phase_seconds_total counter")
+    for snap in snapshots:
+        for name, value in snap["phases"].items():
+            lines.append("bsms_phase_seconds_total{} {:.3f}".format(
+                    prometheus_labels(lecture=snap["lecture"],
+                                      stream=snap["stream"], phase=name),
+                    value))
+    lines.append("# TYPE bsms_request_seconds histogram")
+    for snap in snapshots:
+        labels = dict(lecture=snap["lecture"], stream=snap["stream"])
+        cumulative = 0
+        bounds = [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+        for bound, count in zip(bounds, snap["latency"]["buckets"]):
+            cumulative += count
+            lines.append("bsms_request_seconds_bucket{} {}".format(
+                    prometheus_labels(le=bound, **labels), cumulative))
+        lines.append("bsms_request_seconds_sum{} {:.3f}".format(
+                prometheus_labels(**labels), snap["latency"]["sum"]))
+        lines.append("bsms_request_seconds_count{} {}".format(
+                prometheus_labels(**labels), cumulative))
+    return "\n".join(lines) + "\n"
+
+
+def format_progress(snapshots, rate):
+    def total(kind, name):
+        return sum(snap[kind].get(name, 0) for snap in snapshots)
+
+    line = "[ ] {} streams, {}/{} segments, {:.1f} MiB at {:.1f} MiB/s"
+    line = line.format(
+            sum(1 for snap in snapshots if snap["stream"]),
+            total("counters", "segments"), total("expected", "segments"),
+            total("counters", "bytes") / 2 ** 20, rate / 2 ** 20)
+    retries = total("counters", "retries")
+    if retries:
+        line += ", {} retries".format(retries)
+    return line + "."
+
+
+class Metrics(object):
+    # All stats of the run. A reporter thread renders the progress and writes
+    # the metrics file at a fixed interval, the download threads only bump
+    # counters.
+    def __init__(self, path=None, format="jsonl", interval=1.0,
+                 show_progress=None):
+        self.path = path
+        self.format = format
+        self.interval = interval
+        if show_progress is None:
+            show_progress = sys.stdout.isatty()
+        self.show_progress = show_progress
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.last_bytes = 0
+        self.last_time = time.monotonic()
+        self.shown = False
+
+    def get(self, lecture, stream=""):
+        with self.lock:
+            stats = self.stats.get((lecture, stream))
+            if stats is None:
+                stats = self.stats[(lecture, stream)] = Stats(lecture, stream)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run,
+                                               name="bsms-metrics",
+                                               daemon=True)
+                self.thread.start()
+            return stats
+
+    def snapshots(self):
+        with self.lock:
+            stats = list(self.stats.values())
+        return [item.snapshot() for item in stats]
+
+    def write(self, snapshots):
+        if self.format == "prometheus":
+            # Replaced atomically, so that a collector never reads half of it.
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(prometheus_text(snapshots))
+            os.replace(tmp, self.path)
+        else:
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"time": time.time(),
+                                    "streams": snapshots}) + "\n")
+
+    def report(self):
+        snapshots = self.snapshots()
+        if self.path:
+            self.write(snapshots)
+        if self.show_progress:
+            now = time.monotonic()
+            got = sum(snap["counters"]["bytes"] for snap in snapshots)
+            rate = (got - self.last_bytes) / max(now - self.last_time, 1e-6)
+            self.last_bytes, self.last_time = got, now
+            print("\r\033[K" + format_progress(snapshots, rate), end="",
+                  flush=True)
+            self.shown = True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.report()
+            if self.shown:
+                print()
+
+
+def create_metrics(config):
+    return Metrics(getattr(config, "metrics", None),
+                   getattr(config, "metrics_format", "jsonl"),
+                   getattr(config, "progress_interval", 1.0))
+
+
+def get_metrics():
+    # Returns the metrics of the run, configured from the command line.
+    import utils
+    return utils.get_runtime().part("metrics", create_metrics,
+                                    lambda metrics: metrics.close())
@@ -0,0 +1,148 @@
+import errno
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from os.path import join
+
+import utils
+from postprocess import run_cpu
+from remux import RemuxError, remux, remux_files
+
+
+def ffmpeg_command(inputs, out_fname):
+    cmd = ["ffmpeg", "-y"]
+    for fname in inputs:
+        cmd += ["-i", fname]
+    return cmd + ["-c", "copy", "-f", "mp4", out_fname]
+
+
+def use_ffmpeg():
+    # The built-in remuxer is used when ffmpeg is not wanted or not there.
+    muxer = getattr(utils.config, "muxer", "auto")
+    if muxer == "auto":
+        return shutil.which("ffmpeg") is not None
+    return muxer == "ffmpeg"
+
+
+def ffmpeg_join_files(inputs, out_fname):
+    return subprocess.call(ffmpeg_command(inputs, out_fname)) == 0
+
+
+def python_join_files(inputs, out_fname):
+    try:
+        remux_files(inputs, out_fname)
+    except RemuxError as e:
+        print("[!] Remuxing failed: {}.".format(e))
+        return False
+    return True
+
+
+def join_files(inputs, out_fname):
+    if use_ffmpeg():
+        return ffmpeg_join_files(inputs, out_fname)
+    # The remuxer is pure Python, so it runs in the post-processing pool
+    # where it does not hold up the fetches.
+    return run_cpu(python_join_files, inputs, out_fname)
+
+
+def open_fifo(fifo, proc):
+    # Opening a pipe for writing blocks until the reader opens it, which never
+    # happens if ffmpeg has exited, so poll for it instead.
+    while True:
+        try:
+            fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            if proc.poll() is not None:
+                raise IOError("ffmpeg exited before reading {}.".format(fifo))
+            time.sleep(0.05)
+    os.set_blocking(fd, True)
+    return os.fdopen(fd, "wb")
+
+
+class FifoWriter(object):
+    # Opens the pipe on the first write, as ffmpeg only opens an input after
+    # it has probed the ones before it.
+    def __init__(self, fifo, proc):
+        self.fifo = fifo
+        self.proc = proc
+        self.file = None
+
+    def write(self, data):
+        if self.file is None:
+            self.file = open_fifo(self.fifo, self.proc)
+        return self.file.write(data)
+
+    def close(self):
+        if self.file is None:
+            self.file = open_fifo(self.fifo, self.proc)
+        self.file.close()
+
+
+def ffmpeg_join_streams(feed, count, out_fname):
+    # Runs ffmpeg on `count` named pipes and calls feed with a writer for
+    # each, so that the output is muxed while the tracks are still being
+    # downloaded. The feed has to close each writer once its track is done.
+    tmp_dir = tempfile.mkdtemp(prefix="bsms-")
+    try:
+        fifos = [join(tmp_dir, "track{}".format(i)) for i in range(count)]
+        for fifo in fifos:
+            os.mkfifo(fifo)
+        proc = subprocess.Popen(ffmpeg_command(fifos, out_fname))
+        try:
+            feed([FifoWriter(fifo, proc) for fifo in fifos])
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        return proc.wait() == 0
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def python_join_streams(feed, count, out_fname):
+    # Same as with ffmpeg, but the remuxer reads the pipes in a thread.
+    pipes = [os.pipe() for _ in range(count)]
+    readers = [os.fdopen(r, "rb") for r, _ in pipes]
+    writers = [os.fdopen(w, "wb") for _, w in pipes]
+    result = []
+
+    def run():
+        try:
+            with open(out_fname, "wb") as out:
+                remux(readers, out)
+            result.append(True)
+        except RemuxError as e:
+            print("[!] Remuxing failed: {}.".format(e))
+        finally:
+            # Makes the feed fail instead of block if remuxing stopped early.
+            for reader in readers:
+                reader.close()
+
+    thread = threading.Thread(target=run, name="bsms-remux")
+    thread.start()
+    try:
+        feed(writers)
+    finally:
+        for writer in writers:
+            try:
+                writer.close()
+            except OSError:
+                pass
+        thread.join()
+    return bool(result)
+
+
+def join_streams(feed, count, out_fname):
+    if use_ffmpeg():
+        return ffmpeg_join_streams(feed, count, out_fname)
+    return python_join_streams(feed, count, out_fname)
+
+
+def can_pipe():
+    return not use_ffmpeg() or hasattr(os, "mkfifo")
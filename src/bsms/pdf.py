@@ -0,0 +1,178 @@
+import struct
+import zlib
+from io import BytesIO
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA,
+                    0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_COLOR_SPACES = {1: "/DeviceGray", 3: "/DeviceRGB", 4: "/DeviceCMYK"}
+PNG_COLORS = {0: 1, 2: 3, 3: 1}
+
+
+def jpeg_info(data):
+    # Walk the JPEG markers up to the start of frame, which holds the size.
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("Bad JPEG marker.")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        if marker in JPEG_SOF_MARKERS:
+            bpc, h, w, components = struct.unpack(">BHHB",
+                                                  data[pos + 4:pos + 10])
+            if components not in JPEG_COLOR_SPACES:
+                raise ValueError("Unsupported JPEG components.")
+            info = {"width": w, "height": h, "bpc": bpc,
+                    "colorspace": JPEG_COLOR_SPACES[components],
+                    "filter": "/DCTDecode", "data": data}
+            if components == 4:
+                # Adobe CMYK JPEGs are stored inverted.
+                info["decode"] = "[1 0 1 0 1 0 1 0]"
+            return info
+        pos += 2 + length
+    raise ValueError("No JPEG frame header.")
+
+
+def png_info(data):
+    # Non-interlaced PNGs without alpha can be embedded as they are, the PDF
+    # Flate predictor understands the PNG scanline filters.
+    pos = len(PNG_SIGNATURE)
+    idat = []
+    palette = None
+    header = None
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        if kind == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif kind == b"PLTE":
+            palette = body
+        elif kind == b"IDAT":
+            idat.append(body)
+        elif kind == b"IEND":
+            break
+        pos += 12 + length
+    if header is None:
+        raise ValueError("No PNG header.")
+    w, h, bpc, color_type, _, _, interlace = header
+    if color_type not in PNG_COLORS or interlace or bpc > 8:
+        return None
+    if color_type == 3:
+        colorspace = "[/Indexed /DeviceRGB {} <{}>]".format(
+                len(palette) // 3 - 1, palette.hex())
+    else:
+        colorspace = "/DeviceGray" if color_type == 0 else "/DeviceRGB"
+    return {"width": w, "height": h, "bpc": bpc, "colorspace": colorspace,
+            "filter": "/FlateDecode", "data": b"".join(idat),
+            "decode_parms": "<</Predictor 15 /Colors {} /BitsPerComponent {} "
+                            "/Columns {}>>".format(PNG_COLORS[color_type],
+                                                   bpc, w)}
+
+
+def decoded_info(data):
+    from PIL import Image
+    img = Image.open(BytesIO(data)).convert("RGB")
+    w, h = img.size
+    return {"width": w, "height": h, "bpc": 8, "colorspace": "/DeviceRGB",
+            "filter": "/FlateDecode", "data": zlib.compress(img.tobytes())}
+
+
+def header_info(data):
+    # Only the headers are parsed, the image data is embedded as is. None if
+    # the image is in a format the PDF cannot hold directly.
+    if data.startswith(b"\xff\xd8"):
+        return jpeg_info(data)
+    elif data.startswith(PNG_SIGNATURE):
+        return png_info(data)
+    return None
+
+
+class StreamingPDF(object):
+    # A PDF writer that writes every image as soon as it is added. The page
+    # objects are tiny and written at the end, once the largest image is
+    # known, so that all pages get the same size like with FPDF.
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, f):
+        self.f = f
+        self.offsets = {}
+        self.pages = []
+        self.next_id = 3
+        self.max_w = 0
+        self.max_h = 0
+        self.f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write_obj(self, obj_id, body, stream=None):
+        self.offsets[obj_id] = self.f.tell()
+        self.f.write("{} 0 obj\n".format(obj_id).encode())
+        self.f.write(body.encode())
+        if stream is not None:
+            self.f.write(b"\nstream\n")
+            self.f.write(stream)
+            self.f.write(b"\nendstream")
+        self.f.write(b"\nendobj\n")
+
+    def _new_id(self):
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def add_image_page(self, info):
+        w = info["width"]
+        h = info["height"]
+        image_id = self._new_id()
+        extra = ""
+        if "decode_parms" in info:
+            extra += " /DecodeParms " + info["decode_parms"]
+        if "decode" in info:
+            extra += " /Decode " + info["decode"]
+        self._write_obj(image_id,
+                        "<</Type /XObject /Subtype /Image /Width {} /Height {} "
+                        "/ColorSpace {} /BitsPerComponent {} /Filter {}{} "
+                        "/Length {}>>".format(w, h, info["colorspace"],
+                                              info["bpc"], info["filter"],
+                                              extra, len(info["data"])),
+                        info["data"])
+        content = "q {} 0 0 {} 0 0 cm /I0 Do Q".format(w, h).encode()
+        content_id = self._new_id()
+        self._write_obj(content_id, "<</Length {}>>".format(len(content)),
+                        content)
+        self.pages.append((image_id, content_id, h))
+        self.max_w = max(self.max_w, w)
+        self.max_h = max(self.max_h, h)
+
+    def close(self):
+        page_ids = []
+        for image_id, content_id, h in self.pages:
+            page_id = self._new_id()
+            # The image sits at the origin, move the page box so that the
+            # image ends up in the top left corner.
+            self._write_obj(page_id,
+                            "<</Type /Page /Parent {} 0 R "
+                            "/MediaBox [0 {} {} {}] "
+                            "/Resources <</XObject <</I0 {} 0 R>>>> "
+                            "/Contents {} 0 R>>".format(self.PAGES,
+                                                        h - self.max_h,
+                                                        self.max_w, h,
+                                                        image_id, content_id))
+            page_ids.append(page_id)
+        self._write_obj(self.PAGES,
+                        "<</Type /Pages /Kids [{}] /Count {}>>".format(
+                                " ".join("{} 0 R".format(page_id)
+                                         for page_id in page_ids),
+                                len(page_ids)))
+        self._write_obj(self.CATALOG,
+                        "<</Type /Catalog /Pages {} 0 R>>".format(self.PAGES))
+        xref = self.f.tell()
+        self.f.write("xref\n0 {}\n".format(self.next_id).encode())
+        self.f.write(b"0000000000 65535 f \n")
+        for obj_id in range(1, self.next_id):
+            self.f.write("{:010d} 00000 n \n".format(
+                    self.offsets[obj_id]).encode())
+        self.f.write("trailer\n<</Size {} /Root {} 0 R>>\nstartxref\n{}\n"
+                     "%%EOF\n".format(self.next_id, self.CATALOG,
+                                      xref).encode())
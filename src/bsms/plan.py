@@ -0,0 +1,161 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from os import pardir, replace, sep
+from os.path import abspath, relpath
+
+import utils
+from ranged import probe_size
+from utils import vprint
+
+PLAN_VERSION = 1
+
+
+def planning():
+    return bool(getattr(utils.config, "plan", None))
+
+
+def get_plan_workers():
+    return max(1, getattr(utils.config, "plan_workers", None) or 8)
+
+
+def get_lecture_jobs():
+    # Lectures are resolved concurrently when planning, downloads keep to
+    # --jobs.
+    if planning():
+        return get_plan_workers()
+    return utils.config.jobs
+
+
+def get_probes():
+    # The pool sending the HEAD requests of all lectures being planned.
+    return utils.get_runtime().part(
+            "probes",
+            lambda config: ThreadPoolExecutor(max_workers=get_plan_workers()),
+            lambda probes: probes.shutdown())
+
+
+def size_stream(session, stream):
+    # Counts the segments of a stream and totals their Content-Length, the
+    # ones whose size the server does not tell are counted as unsized.
+    urls = [url for track in stream["tracks"] for url in track]
+    params = stream["params"]
+    sizes = list(get_probes().map(lambda url: probe_size(session, url,
+                                                         params), urls))
+    stream["segments"] = len(urls)
+    stream["bytes"] = sum(size for size in sizes if size is not None)
+    stream["unsized"] = sizes.count(None)
+    return stream
+
+
+def summarize(entries):
+    return {
+        "segments": sum(entry["segments"] for entry in entries),
+        "bytes": sum(entry["bytes"] for entry in entries),
+        "unsized": sum(entry["unsized"] for entry in entries),
+    }
+
+
+def format_duration(seconds):
+    return str(timedelta(seconds=int(round(seconds or 0))))
+
+
+class Plan(object):
+    # Lectures resolved down to the urls of their segments, with their
+    # durations and sizes. The lectures are jobs, with their streams the
+    # downloader fetches them without scraping again. Each stream has its
+    # type, the suffix of its output, the request params and its tracks of
+    # urls. Outputs under the root are kept relative to it, so that the plan
+    # can be downloaded into another root.
+    def __init__(self, path, root="."):
+        self.path = path
+        self.root = root
+        self.lock = threading.Lock()
+        self.lectures = []
+
+    def add(self, platform, url, output, streams, duration=None):
+        # The streams of a lecture play alongside, so the longest one is the
+        # duration of the lecture, if any stream tells it.
+        durations = [stream["duration"] for stream in streams
+                     if stream["duration"]]
+        lecture = dict(summarize(streams), platform=platform, kind="lecture",
+                       url=url, output=self.relative(output), streams=streams,
+                       duration=max(durations) if durations else duration)
+        vprint("[*] Planned {}: {} segments, {}, {:.1f} MiB.".format(
+                output, lecture["segments"],
+                format_duration(lecture["duration"]),
+                lecture["bytes"] / 2 ** 20))
+        with self.lock:
+            self.lectures.append(lecture)
+        return lecture
+
+    def relative(self, output):
+        relative = relpath(abspath(output), abspath(self.root))
+        if relative == pardir or relative.startswith(pardir + sep):
+            return abspath(output)
+        return relative
+
+    def totals(self):
+        with self.lock:
+            lectures = list(self.lectures)
+        return dict(summarize(lectures), lectures=len(lectures),
+                    streams=sum(len(lecture["streams"])
+                                for lecture in lectures),
+                    duration=sum(lecture["duration"] or 0
+                                 for lecture in lectures))
+
+    def write(self):
+        totals = self.totals()
+        with self.lock:
+            # Lectures are planned concurrently, keep the file stable.
+            lectures = sorted(self.lectures, key=lambda lecture: (
+                    lecture["output"], lecture["url"]))
+        tmp_path = self.path + ".part"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": PLAN_VERSION, "totals": totals,
+                       "lectures": lectures}, f, indent=2)
+        replace(tmp_path, self.path)
+        return totals
+
+
+def get_plan():
+    # Returns the plan being made, None if not planning.
+    return utils.get_runtime().part("plan", create_plan)
+
+
+def create_plan(config):
+    path = getattr(config, "plan", None)
+    if not path:
+        return None
+    return Plan(path, getattr(config, "output_root", None) or ".")
+
+
+def add_lecture(platform, url, output, streams, session, duration=None):
+    for stream in streams:
+        size_stream(session, stream)
+    return get_plan().add(platform, url, output, streams, duration)
+
+
+def write_plan():
+    # Writes the plan, if planning, and prints its totals.
+    plan = get_plan()
+    if plan is None:
+        return None
+    totals = plan.write()
+    line = "[*] Planned {} lectures, {} streams, {} segments, {}, {:.1f} MiB"
+    line = line.format(totals["lectures"], totals["streams"],
+                       totals["segments"], format_duration(totals["duration"]),
+                       totals["bytes"] / 2 ** 20)
+    if totals["unsized"]:
+        line += " and {} segments of unknown size".format(totals["unsized"])
+    print(line + ", written to {}.".format(plan.path))
+    return totals
+
+
+def plan_jobs(document):
+    # The lectures of a plan document, as jobs.
+    if document.get("version") != PLAN_VERSION:
+        raise ValueError("Unsupported plan version: {}.".format(
+                document.get("version")))
+    return document["lectures"]
@@ -0,0 +1,41 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import utils
+
+
+def get_cpu_workers():
+    # A process per CPU by default, with a single CPU starting processes
+    # would only add to the work.
+    workers = getattr(utils.config, "cpu_workers", None)
+    if workers is None:
+        cpus = os.cpu_count() or 1
+        return cpus if cpus > 1 else 0
+    return workers
+
+
+def get_pool():
+    # Returns the process pool of the CPU bound post-processing, None if it
+    # runs inline. The workers are spawned rather than forked, the download
+    # threads may hold locks at the time of the fork.
+    return utils.get_runtime().part("pool", create_pool,
+                                    lambda pool: pool.shutdown())
+
+
+def create_pool(config):
+    workers = get_cpu_workers()
+    if workers < 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context("spawn"))
+
+
+def run_cpu(fn, *args):
+    # Runs fn in the pool and waits for it, the waiting thread does not hold
+    # the GIL meanwhile, so the fetches of other lectures go on. The function
+    # and arguments have to be picklable.
+    pool = get_pool()
+    if pool is None:
+        return fn(*args)
+    return pool.submit(fn, *args).result()
@@ -0,0 +1,273 @@
+import http.client
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import replace
+from os.path import exists, getsize
+
+import requests
+import urllib3
+
+from fetch import (FetchError, check_status, get_retries, get_timeout,
+                   retry_delay)
+from journal import SegmentJournal, part_name, journal_name
+from ratelimit import get_limiter, limited_get, limited_head
+from store import get_store
+from utils import vprint, pwrite
+
+PIECE_SIZE = 8 * 1024 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+# Aim for reads that take about this long, so that fast connections use few
+# large reads and slow ones still report progress.
+CHUNK_TIME = 0.25
+
+content_range_re = re.compile(r"bytes \d+-\d+/(\d+)")
+
+
+def probe_length(session, url, params=None):
+    # Returns the total length of the resource if the server supports range
+    # requests, None if it answers the whole body instead. Any other reply is
+    # an error, retried like a fetch, not a sign of missing range support.
+    retries = get_retries()
+    for attempt in range(retries + 1):
+        try:
+            with limited_get(session, url, params=params,
+                             headers={"Range": "bytes=0-0"}, stream=True,
+                             timeout=get_timeout()) as resp:
+                if resp.status_code == 200:
+                    return None
+                check_status(resp.status_code, 206)
+                match = content_range_re.match(
+                        resp.headers.get("content-range", ""))
+                if match is None:
+                    return None
+                return int(match.group(1))
+        except (requests.RequestException, FetchError) as e:
+            if attempt == retries:
+                raise
+            wait_time = retry_delay(attempt)
+            vprint("[!] Probing {} failed: {} Retrying in {:.1f}s.".format(
+                    url, e, wait_time))
+            time.sleep(wait_time)
+
+
+def adapt_chunk_size(chunk_size, elapsed):
+    if elapsed < CHUNK_TIME / 2:
+        return min(chunk_size * 2, MAX_CHUNK_SIZE)
+    if elapsed > CHUNK_TIME * 2:
+        return max(chunk_size // 2, MIN_CHUNK_SIZE)
+    return chunk_size
+
+
+class RangedDownload(object):
+    def __init__(self, session, url, out_fname, total, params=None,
+                 stats=None):
+        self.session = session
+        self.url = url
+        self.params = params
+        self.total = total
+        self.part_fname = part_name(out_fname)
+        self.out_fname = out_fname
+        self.stats = stats
+
+    def pieces(self, piece_size):
+        for index, offset in enumerate(range(0, self.total, piece_size)):
+            yield index, offset, min(piece_size, self.total - offset)
+
+    def expect(self, todo):
+        if self.stats is not None:
+            self.stats.expect("bytes", sum(size for _, _, size in todo))
+
+    def piece_request(self, index, offset, size):
+        # The url, headers and expected status of the request for a piece.
+        headers = {"Range": "bytes={}-{}".format(offset, offset + size - 1)}
+        return self.url, headers, 206
+
+    def write_piece(self, fd, index, offset, size):
+        url, headers, status = self.piece_request(index, offset, size)
+        chunk_size = MIN_CHUNK_SIZE
+        pos = offset
+        limiter = get_limiter()
+        with limited_get(self.session, url, params=self.params,
+                         headers=headers, stream=True,
+                         timeout=get_timeout()) as resp:
+            check_status(resp.status_code, status)
+            while pos < offset + size:
+                start = time.monotonic()
+                try:
+                    chunk = resp.raw.read(chunk_size, decode_content=True)
+                except (urllib3.exceptions.HTTPError,
+                        http.client.IncompleteRead) as e:
+                    # Reading the raw response bypasses the requests
+                    # exceptions, a connection cut short is retried as well.
+                    raise FetchError("Reading piece {} failed: {}".format(
+                            index, e))
+                if not chunk:
+                    break
+                pwrite(fd, chunk, pos)
+                pos += len(chunk)
+                if self.stats is not None:
+                    self.stats.add("bytes", len(chunk))
+                chunk_size = adapt_chunk_size(chunk_size,
+                                              time.monotonic() - start)
+                # Waiting for the bandwidth limit does not count as read time.
+                time.sleep(limiter.read_delay(len(chunk)))
+        if pos != offset + size:
+            raise FetchError("Short response, got {} of {} bytes.".format(
+                    pos - offset, size))
+
+    def fetch_piece(self, fd, journal, index, offset, size):
+        retries = get_retries()
+        for attempt in range(retries + 1):
+            start = time.monotonic()
+            try:
+                self.write_piece(fd, index, offset, size)
+            except (requests.RequestException, FetchError) as e:
+                if attempt == retries:
+                    raise
+                if self.stats is not None:
+                    self.stats.add("retries")
+                wait_time = retry_delay(attempt)
+                vprint("[!] Fetching piece {} failed: {} Retrying in {:.1f}s."
+                       .format(index, e, wait_time))
+                time.sleep(wait_time)
+                continue
+            if self.stats is not None:
+                self.stats.observe(time.monotonic() - start)
+            journal.record(index, offset, size)
+            return
+
+    def run(self, connections=4, piece_size=PIECE_SIZE):
+        journal_fname = journal_name(self.out_fname)
+        if exists(self.part_fname) and getsize(self.part_fname) != self.total:
+            # Not ours or the resource changed, start over.
+            os.remove(self.part_fname)
+            if exists(journal_fname):
+                os.remove(journal_fname)
+        journal = SegmentJournal(journal_fname)
+        todo = [piece for piece in self.pieces(piece_size)
+                if journal.completed.get(piece[0]) != tuple(piece[1:])]
+        done = sum(size for _, _, size in self.pieces(piece_size)) - sum(
+                size for _, _, size in todo)
+        if done:
+            print("[*] Resuming at {} bytes.".format(done))
+        self.expect(todo)
+
+        fd = os.open(self.part_fname, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if hasattr(os, "posix_fallocate") and not done:
+                os.posix_fallocate(fd, 0, self.total)
+            else:
+                os.ftruncate(fd, self.total)
+            with ThreadPoolExecutor(max_workers=connections) as executor:
+                futures = [executor.submit(self.fetch_piece, fd, journal,
+                                           *piece) for piece in todo]
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(fd)
+            journal.close()
+        replace(self.part_fname, self.out_fname)
+        journal.remove()
+
+
+def download_ranged(session, url, out_fname, params=None, connections=4,
+                    piece_size=PIECE_SIZE, stats=None):
+    # Download url into out_fname over several connections, each fetching
+    # byte ranges into their place in a preallocated file. Returns False if
+    # the server does not support range requests.
+    total = probe_length(session, url, params)
+    if not total:
+        return False
+    vprint("[ ] Downloading {} bytes over {} connections.".format(total,
+                                                                 connections))
+    RangedDownload(session, url, out_fname, total, params, stats).run(
+            connections, piece_size)
+    return True
+
+
+class SegmentDownload(RangedDownload):
+    # Segments of known sizes, each fetched whole straight into its place in
+    # the preallocated file, in whatever order they arrive.
+    def __init__(self, session, urls, sizes, out_fname, params=None,
+                 stats=None):
+        super(SegmentDownload, self).__init__(session, None, out_fname,
+                                              sum(sizes), params, stats)
+        self.urls = urls
+        self.sizes = sizes
+
+    def pieces(self, piece_size=None):
+        offset = 0
+        for index, size in enumerate(self.sizes):
+            yield index, offset, size
+            offset += size
+
+    def expect(self, todo):
+        super(SegmentDownload, self).expect(todo)
+        if self.stats is not None:
+            self.stats.expect("segments", len(todo))
+
+    def piece_request(self, index, offset, size):
+        return self.urls[index], None, 200
+
+    def fetch_piece(self, fd, journal, index, offset, size):
+        # Segments are taken from the store and added to it, as when they are
+        # fetched into spools.
+        store = get_store()
+        url = self.urls[index]
+        if store is not None and store.place(url, fd, offset, size):
+            journal.record(index, offset, size)
+            if self.stats is not None:
+                self.stats.add("stored")
+                self.stats.add("bytes", size)
+        else:
+            super(SegmentDownload, self).fetch_piece(fd, journal, index,
+                                                     offset, size)
+            if store is not None:
+                store.add_range(url, fd, offset, size)
+        if self.stats is not None:
+            self.stats.add("segments")
+
+
+def probe_size(session, url, params=None):
+    # The length of the body of url, None if the server does not tell it.
+    try:
+        resp = limited_head(session, url, params=params,
+                            timeout=get_timeout())
+    except requests.RequestException:
+        return None
+    resp.close()
+    length = resp.headers.get("content-length")
+    if resp.status_code != 200 or length is None or resp.headers.get(
+            "content-encoding"):
+        return None
+    return int(length)
+
+
+def probe_sizes(session, urls, params=None, workers=4):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        sizes = list(executor.map(lambda url: probe_size(session, url,
+                                                         params), urls))
+    if None in sizes or 0 in sizes:
+        return None
+    return sizes
+
+
+def download_sized(session, urls, out_fname, params=None, workers=4,
+                   stats=None):
+    # Download segments into a file preallocated to their total size, each
+    # written at its offset as soon as it arrives. Returns False if the sizes
+    # are not known or a partial download in order is already there.
+    sizes = probe_sizes(session, urls, params, workers)
+    if sizes is None:
+        return False
+    part_fname = part_name(out_fname)
+    if exists(part_fname) and getsize(part_fname) != sum(sizes):
+        return False
+    vprint("[ ] Downloading {} segments, {} bytes, into place.".format(
+            len(sizes), sum(sizes)))
+    SegmentDownload(session, urls, sizes, out_fname, params, stats).run(
+            workers)
+    return True
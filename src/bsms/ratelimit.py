@@ -0,0 +1,157 @@
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import utils
+
+# Statuses with which a server tells us to slow down.
+THROTTLE_STATUSES = {429, 503}
+# A throttled host is first backed off this long, doubling on every further
+# throttled response up to the maximum, and halving on every good one.
+BACKOFF_MIN = 1.0
+BACKOFF_MAX = 60.0
+MAX_BACKOFFS = 8
+
+
+rate_re = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kKmMgG]?)i?[bB]?\s*$")
+RATE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def parse_rate(value):
+    # Bytes per second, optionally with a K, M or G suffix.
+    match = rate_re.match(value)
+    if match is None:
+        raise ValueError("Invalid rate: {}.".format(value))
+    return float(match.group(1)) * RATE_UNITS[match.group(2).lower()]
+
+
+def retry_after(headers):
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket(object):
+    # Bytes are paid for after they are read, going into debt if needed, and
+    # the reader then waits the debt off. This way the bucket can be shared by
+    # threads and coroutines alike, they only get told how long to wait.
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        if burst is None:
+            burst = max(rate, utils.CHUNK_SIZE)
+        self.burst = burst
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def delay(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+
+class HostState(object):
+    def __init__(self):
+        self.next = 0
+        self.backoff = 0
+
+
+class Limiter(object):
+    # Global bandwidth limit and per host request rate, with backoff on
+    # throttled responses. All delays are returned rather than slept, so that
+    # both engines can wait in their own way.
+    def __init__(self, max_rate=None, max_rps=None):
+        self.bucket = TokenBucket(max_rate) if max_rate else None
+        self.interval = 1 / max_rps if max_rps else 0
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def host(self, url):
+        netloc = urlparse(url).netloc
+        state = self.hosts.get(netloc)
+        if state is None:
+            state = self.hosts[netloc] = HostState()
+        return state
+
+    def request_delay(self, url):
+        # Reserves the next request slot of the host.
+        with self.lock:
+            state = self.host(url)
+            now = time.monotonic()
+            slot = max(now, state.next)
+            state.next = slot + max(self.interval, state.backoff)
+            return slot - now
+
+    def read_delay(self, amount):
+        if self.bucket is None:
+            return 0
+        return self.bucket.delay(amount)
+
+    def response(self, url, status, headers):
+        # Returns how long to wait before retrying a throttled response, None
+        # if the response was not throttled.
+        with self.lock:
+            state = self.host(url)
+            if status not in THROTTLE_STATUSES:
+                state.backoff /= 2
+                if state.backoff < BACKOFF_MIN:
+                    state.backoff = 0
+                return None
+            state.backoff = min(max(state.backoff * 2, BACKOFF_MIN),
+                                BACKOFF_MAX)
+            delay = max(retry_after(headers) or 0, state.backoff)
+            state.next = max(state.next, time.monotonic() + delay)
+        utils.vprint("[!] Got {} from {}, backing off {:.1f}s.".format(
+                status, urlparse(url).netloc, delay))
+        return delay
+
+
+def create_limiter(config):
+    return Limiter(getattr(config, "max_rate", None),
+                   getattr(config, "max_rps", None))
+
+
+def get_limiter():
+    # Returns the limiter shared by all downloads of the run.
+    return utils.get_runtime().part("limiter", create_limiter)
+
+
+def limited_request(session, method, url, **kwargs):
+    # session.request, waiting for a request slot of the host and retrying
+    # while it throttles us.
+    limiter = get_limiter()
+    for attempt in range(MAX_BACKOFFS + 1):
+        time.sleep(limiter.request_delay(url))
+        resp = session.request(method, url, **kwargs)
+        delay = limiter.response(url, resp.status_code, resp.headers)
+        if delay is None or attempt == MAX_BACKOFFS:
+            return resp
+        resp.close()
+        time.sleep(delay)
+
+
+def limited_get(session, url, **kwargs):
+    return limited_request(session, "GET", url, **kwargs)
+
+
+def limited_head(session, url, **kwargs):
+    return limited_request(session, "HEAD", url, allow_redirects=True,
+                           **kwargs)
+
+
+def limited_read(chunks):
+    # Passes chunks through, keeping the reader within the bandwidth limit.
+    limiter = get_limiter()
+    for chunk in chunks:
+        delay = limiter.read_delay(len(chunk))
+        if delay:
+            time.sleep(delay)
+        yield chunk
@@ -0,0 +1,303 @@
+import struct
+
+# Boxes of the fragment stream that are only valid for the input they came
+# from, they are dropped and an mfra index is written at the end instead.
+DROPPED_BOXES = {b"styp", b"sidx", b"ssix", b"mfra", b"free", b"skip"}
+TFHD_BASE_DATA_OFFSET = 0x000001
+
+
+class RemuxError(Exception):
+    pass
+
+
+def read_exact(f, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = f.read(size - len(data))
+        if not chunk:
+            raise RemuxError("Truncated box.")
+        data += chunk
+    return bytes(data)
+
+
+def read_box(f):
+    # Returns the type and the complete bytes of the next top level box, or
+    # None at the end of the input.
+    header = f.read(8)
+    if not header:
+        return None
+    if len(header) < 8:
+        header += read_exact(f, 8 - len(header))
+    size, kind = struct.unpack(">I4s", header)
+    if size == 1:
+        ext = read_exact(f, 8)
+        header += ext
+        size = struct.unpack(">Q", ext)[0]
+    elif size == 0:
+        # Extends to the end of the input.
+        body = bytearray()
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            body += chunk
+        return kind, header + bytes(body)
+    return kind, header + read_exact(f, size - len(header))
+
+
+def children(box):
+    # Yields (type, start, end) of the child boxes of a container box.
+    pos = 16 if struct.unpack(">I", box[:4])[0] == 1 else 8
+    while pos + 8 <= len(box):
+        size, kind = struct.unpack(">I4s", box[pos:pos + 8])
+        if size == 1:
+            size = struct.unpack(">Q", box[pos + 8:pos + 16])[0]
+        elif size == 0:
+            size = len(box) - pos
+        yield kind, pos, pos + size
+        pos += size
+
+
+def child(box, kind):
+    for child_kind, start, end in children(box):
+        if child_kind == kind:
+            return box[start:end]
+    return None
+
+
+def make_box(kind, *parts):
+    body = b"".join(parts)
+    return struct.pack(">I4s", 8 + len(body), kind) + body
+
+
+def full_box_version(box):
+    return box[8]
+
+
+def patch_u32(box, offset, value):
+    box = bytearray(box)
+    struct.pack_into(">I", box, offset, value)
+    return bytes(box)
+
+
+def set_tkhd_track_id(tkhd, track_id):
+    return patch_u32(tkhd, 20 if full_box_version(tkhd) == 0 else 28,
+                     track_id)
+
+
+def set_trex_track_id(trex, track_id):
+    return patch_u32(trex, 12, track_id)
+
+
+def mdhd_timescale(mdhd):
+    return struct.unpack(">I", mdhd[20:24] if full_box_version(mdhd) == 0
+                         else mdhd[28:32])[0]
+
+
+def mvhd_timescale(mvhd):
+    return mdhd_timescale(mvhd)
+
+
+def mehd_duration(mehd):
+    if full_box_version(mehd) == 0:
+        return struct.unpack(">I", mehd[12:16])[0]
+    return struct.unpack(">Q", mehd[12:20])[0]
+
+
+def set_mehd_duration(mehd, duration):
+    if full_box_version(mehd) == 0:
+        return patch_u32(mehd, 12, min(duration, 0xFFFFFFFF))
+    box = bytearray(mehd)
+    struct.pack_into(">Q", box, 12, duration)
+    return bytes(box)
+
+
+class Input(object):
+    # One single track fragmented MP4 input, read box by box.
+    def __init__(self, f):
+        self.f = f
+        self.pos = 0
+        self.ftyp = None
+        self.moov = None
+        while self.moov is None:
+            box = self.read_box()
+            if box is None:
+                raise RemuxError("No moov box in input.")
+            kind, data = box
+            if kind == b"ftyp":
+                self.ftyp = data
+            elif kind == b"moov":
+                self.moov = data
+        traks = [self.moov[start:end]
+                 for kind, start, end in children(self.moov)
+                 if kind == b"trak"]
+        if len(traks) != 1:
+            raise RemuxError("Expected a single track, got {}.".format(
+                    len(traks)))
+        self.trak = traks[0]
+        self.timescale = mdhd_timescale(child(child(self.trak, b"mdia"),
+                                              b"mdhd"))
+        mvex = child(self.moov, b"mvex")
+        if mvex is None:
+            raise RemuxError("Input is not fragmented.")
+        self.trex = child(mvex, b"trex")
+        self.mehd = child(mvex, b"mehd")
+        self.movie_timescale = mvhd_timescale(child(self.moov, b"mvhd"))
+        self.fragment = None
+        self.advance()
+
+    def read_box(self):
+        box = read_box(self.f)
+        if box is not None:
+            self.pos += len(box[1])
+        return box
+
+    def advance(self):
+        # Reads the next moof, its position and its mdat.
+        self.fragment = None
+        moof = None
+        moof_pos = None
+        while True:
+            pos = self.pos
+            box = self.read_box()
+            if box is None:
+                if moof is not None:
+                    raise RemuxError("Fragment without mdat.")
+                return
+            kind, data = box
+            if kind == b"moof":
+                moof = data
+                moof_pos = pos
+            elif kind == b"mdat" and moof is not None:
+                self.fragment = (moof, data, moof_pos)
+                return
+            elif kind not in DROPPED_BOXES:
+                raise RemuxError("Unexpected {} box.".format(
+                        kind.decode("ascii", "replace")))
+
+    def decode_time(self):
+        # Decode time of the next fragment, in track units and in seconds.
+        tfdt = child(child(self.fragment[0], b"traf"), b"tfdt")
+        if tfdt is None:
+            return 0, 0
+        if full_box_version(tfdt) == 0:
+            value = struct.unpack(">I", tfdt[12:16])[0]
+        else:
+            value = struct.unpack(">Q", tfdt[12:20])[0]
+        return value, value / self.timescale
+
+
+def merge_moov(inputs):
+    # The first input's moov with the tracks of all inputs, renumbered from 1.
+    first = inputs[0]
+    traks = []
+    trexs = []
+    duration = 0
+    for track_id, inp in enumerate(inputs, 1):
+        trak = inp.trak
+        tkhd_start, tkhd_end = [(start, end)
+                                for kind, start, end in children(trak)
+                                if kind == b"tkhd"][0]
+        trak = trak[:tkhd_start] + set_tkhd_track_id(
+                trak[tkhd_start:tkhd_end], track_id) + trak[tkhd_end:]
+        traks.append(trak)
+        trexs.append(set_trex_track_id(inp.trex, track_id))
+        if inp.mehd is not None:
+            duration = max(duration, mehd_duration(
+                    inp.mehd) * first.movie_timescale // inp.movie_timescale)
+
+    parts = []
+    for kind, start, end in children(first.moov):
+        data = first.moov[start:end]
+        if kind == b"mvhd":
+            # next_track_ID is the last field.
+            parts.append(patch_u32(data, len(data) - 4, len(inputs) + 1))
+        elif kind == b"trak":
+            parts.extend(traks)
+        elif kind == b"mvex":
+            mvex_parts = []
+            if first.mehd is not None:
+                mvex_parts.append(set_mehd_duration(first.mehd, duration))
+            mvex_parts.extend(trexs)
+            parts.append(make_box(b"mvex", *mvex_parts))
+        else:
+            parts.append(data)
+    return make_box(b"moov", *parts)
+
+
+def rewrite_moof(moof, sequence, track_id, old_pos, new_pos):
+    parts = []
+    for kind, start, end in children(moof):
+        data = moof[start:end]
+        if kind == b"mfhd":
+            data = patch_u32(data, 12, sequence)
+        elif kind == b"traf":
+            traf_parts = []
+            for traf_kind, traf_start, traf_end in children(data):
+                traf_child = data[traf_start:traf_end]
+                if traf_kind == b"tfhd":
+                    traf_child = bytearray(patch_u32(traf_child, 12,
+                                                     track_id))
+                    flags = struct.unpack(">I", traf_child[8:12])[0]
+                    if flags & TFHD_BASE_DATA_OFFSET:
+                        # An absolute offset into the input, move it along.
+                        base = struct.unpack(">Q", traf_child[16:24])[0]
+                        struct.pack_into(">Q", traf_child, 16,
+                                         base - old_pos + new_pos)
+                    traf_child = bytes(traf_child)
+                traf_parts.append(traf_child)
+            data = make_box(b"traf", *traf_parts)
+        parts.append(data)
+    return make_box(b"moof", *parts)
+
+
+def make_mfra(entries):
+    # Random access index, one tfra per track of (time, moof offset).
+    tfras = []
+    for track_id in sorted(entries):
+        body = struct.pack(">BxxxII", 1, track_id, 0) + struct.pack(
+                ">I", len(entries[track_id]))
+        for time, offset in entries[track_id]:
+            body += struct.pack(">QQBBB", time, offset, 1, 1, 1)
+        tfras.append(make_box(b"tfra", body))
+    size = 8 + sum(len(tfra) for tfra in tfras) + 16
+    mfro = make_box(b"mfro", struct.pack(">II", 0, size))
+    return make_box(b"mfra", *(tfras + [mfro]))
+
+
+def remux(sources, out):
+    # Merges single track fragmented MP4 streams into one fragmented MP4,
+    # interleaving the fragments by decode time. Sources and output are read
+    # and written sequentially, so they may be pipes.
+    inputs = [Input(source) for source in sources]
+    ftyp = inputs[0].ftyp or make_box(b"ftyp", b"iso6", struct.pack(">I", 0),
+                                      b"iso6", b"mp41")
+    out.write(ftyp)
+    moov = merge_moov(inputs)
+    out.write(moov)
+    pos = len(ftyp) + len(moov)
+    sequence = 1
+    entries = {track_id: [] for track_id in range(1, len(inputs) + 1)}
+    while True:
+        ready = [(inp.decode_time()[1], track_id, inp)
+                 for track_id, inp in enumerate(inputs, 1)
+                 if inp.fragment is not None]
+        if not ready:
+            break
+        _, track_id, inp = min(ready, key=lambda item: item[:2])
+        moof, mdat, moof_pos = inp.fragment
+        entries[track_id].append((inp.decode_time()[0], pos))
+        new_moof = rewrite_moof(moof, sequence, track_id, moof_pos, pos)
+        out.write(new_moof)
+        out.write(mdat)
+        pos += len(new_moof) + len(mdat)
+        sequence += 1
+        inp.advance()
+    out.write(make_mfra(entries))
+
+
+def remux_files(inputs, out_fname):
+    sources = [open(fname, "rb") for fname in inputs]
+    try:
+        with open(out_fname, "wb") as out:
+            remux(sources, out)
+    finally:
+        for source in sources:
+            source.close()
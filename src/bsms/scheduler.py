@@ -0,0 +1,76 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+def get_slots():
+    # Returns the semaphore capping the lectures downloaded at once across
+    # all courses and jobs of the process, None if there is no cap.
+    import utils
+    return utils.get_runtime().part("slots", create_slots)
+
+
+def create_slots(config):
+    limit = getattr(config, "max_lectures", None)
+    return threading.BoundedSemaphore(limit) if limit else None
+
+
+@contextmanager
+def lecture_slot():
+    slots = get_slots()
+    if slots is None:
+        yield
+        return
+    with slots:
+        yield
+
+
+def in_slot(fn, *args, **kwargs):
+    with lecture_slot():
+        return fn(*args, **kwargs)
+
+
+class Scheduler(object):
+    # Runs jobs on a pool of threads. The jobs of a capped scheduler are
+    # lectures and also wait for a slot under the process wide cap.
+    def __init__(self, jobs=1, capped=False):
+        self.jobs = max(1, jobs)
+        self.capped = capped
+        self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+        self.futures = []
+
+    def submit(self, fn, *args, **kwargs):
+        if self.capped:
+            fn, args = in_slot, (fn,) + args
+        future = self.executor.submit(fn, *args, **kwargs)
+        self.futures.append(future)
+        return future
+
+    def wait(self):
+        # Collect results of all submitted jobs, a job fails when it returns
+        # a falsy value or raises.
+        ok = True
+        futures, self.futures = self.futures, []
+        for future in futures:
+            try:
+                if not future.result():
+                    ok = False
+            except Exception as e:
+                print("[!] Job failed: {}.".format(e))
+                ok = False
+        return ok
+
+    def running(self):
+        # Forget the finished jobs and return the number of unfinished ones,
+        # for schedulers that live longer than one batch of jobs.
+        self.futures = [future for future in self.futures
+                        if not future.done()]
+        return len(self.futures)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
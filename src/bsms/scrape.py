@@ -0,0 +1,100 @@
+import re
+
+# The scrapers only need a handful of elements from each page, so instead of
+# building a BeautifulSoup tree of the whole page and walking it in Python,
+# the page is parsed by lxml and the elements are picked by XPath, which runs
+# in C.
+
+
+def has_class(name):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(
+            name)
+
+
+CONTENT_IFRAME = "//*[@id='ContentView']//*[{}]/@src".format(
+        has_class("d2l-iframe"))
+FORM = "(//form)[1]"
+INPUTS = "//input"
+PLAYER_SCRIPT = "//script[not(@src)][contains(., 'new Player')]/text()"
+# The text of the videos menu entry, the module id is on its seventh ancestor.
+VIDEOS_MODULE = "(//div[count(node()) = 1][contains(., 'Video')])[1]" \
+                "/ancestor::*[7]/@id"
+LECTURE_LINKS = "(//*[{}])[1]//a[{}]".format(has_class("vui-list"),
+                                               has_class("d2l-link"))
+GLOBAL_DATA = "//*[@id='GlobalData']//*[@id='{}']"
+MAIN_FORM_SCRIPTS = "//*[@id='MainForm']//script/text()"
+
+catalog_id_re = re.compile(r"CatalogId: *'([a-f0-9\-]+?)'")
+
+
+class ScrapeError(ValueError):
+    pass
+
+
+def parse(text):
+    # lxml takes a while to import, so only do it when scraping.
+    from lxml import etree
+    parser = etree.HTMLParser()
+    root = etree.fromstring(text, parser)
+    if root is None:
+        raise ScrapeError("Empty page.")
+    return root
+
+
+def first(root, path, what):
+    found = root.xpath(path)
+    if not found:
+        raise ScrapeError("Cannot find {}.".format(what))
+    return found[0]
+
+
+def inner_text(elem):
+    return "".join(elem.itertext())
+
+
+def content_iframe(text):
+    # The src of the iframe in the content view of a Brightspace topic.
+    return str(first(parse(text), CONTENT_IFRAME, "the content iframe"))
+
+
+def form_fields(text):
+    # The action and the input values of the first form on the page.
+    root = parse(text)
+    form = first(root, FORM, "the form")
+    return form.attrib["action"], {input.attrib["name"]: input.attrib["value"]
+                                   for input in root.xpath(INPUTS)}
+
+
+def player_script(text):
+    # The inline script that creates the Brightspace player.
+    return str(first(parse(text), PLAYER_SCRIPT, "the player script"))
+
+
+def videos_module_id(text):
+    # The id of the videos module in the Brightspace course content menu.
+    module = first(parse(text), VIDEOS_MODULE, "the videos module")
+    return module.split("-")[-1]
+
+
+def lecture_links(html):
+    # The href and title of every lecture in a Brightspace module listing.
+    return [(link.attrib["href"], inner_text(link))
+            for link in parse(html).xpath(LECTURE_LINKS)]
+
+
+def global_data(text, *names):
+    # Values from the GlobalData block of a Mediasite player page.
+    root = parse(text)
+    return [inner_text(first(root, GLOBAL_DATA.format(name), name))
+            for name in names]
+
+
+def catalog_id(text):
+    # The catalog id from the scripts of a Mediasite catalog page, the last
+    # one wins.
+    found = None
+    for script in parse(text).xpath(MAIN_FORM_SCRIPTS):
+        match = catalog_id_re.search(script)
+        if match:
+            found = match.group(1)
+    return found
@@ -0,0 +1,225 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from os.path import exists, join
+
+import utils
+from utils import vprint
+
+# ioctl of Linux filesystems with copy-on-write clones, btrfs and XFS.
+FICLONE = 0x40049409
+HASH_CHUNK = 1024 * 1024
+
+
+def file_digest(f):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def spool_digest(spool):
+    # Hashes a fetched spool and leaves it at its end, where the writers
+    # expect it.
+    if getattr(spool, "in_memory", False):
+        with spool.buffer.getbuffer() as view:
+            return hashlib.sha256(view).hexdigest()
+    end = spool.tell()
+    spool.seek(0)
+    try:
+        return file_digest(spool)
+    finally:
+        spool.seek(end)
+
+
+def reflink(src, dst):
+    # A copy-on-write clone, False where the filesystem has none.
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        if exists(dst):
+            os.remove(dst)
+        return False
+
+
+class SegmentStore(object):
+    # Content addressed store of segments and finished outputs, shared by all
+    # lectures and runs. Objects are named by the SHA-256 of their content,
+    # an index maps segment urls to them, so that a segment seen before is
+    # not fetched again. Outputs are moved into the store and linked back,
+    # so that duplicate lectures take the space once.
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(join(path, "objects"), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(join(path, "index.sqlite"),
+                                  check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS segments ("
+                            "url TEXT PRIMARY KEY, digest TEXT, "
+                            "size INTEGER)")
+
+    def object_path(self, digest):
+        return join(self.path, "objects", digest[:2], digest[2:])
+
+    def open(self, url):
+        # Returns the stored segment of the url as a file at its end, like a
+        # fetched spool, or None if it is not in the store.
+        with self.lock:
+            row = self.db.execute("SELECT digest, size FROM segments "
+                                  "WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        try:
+            f = open(self.object_path(row[0]), "rb")
+        except FileNotFoundError:
+            return None
+        # An object cut short or damaged since is dropped and fetched again.
+        if file_digest(f) != row[0] or f.tell() != row[1]:
+            f.close()
+            vprint("[!] Stored object of {} is damaged, dropping it.".format(
+                    url))
+            self.drop(url, row[0])
+            return None
+        vprint("[*] Stored: {}.".format(url))
+        return f
+
+    def drop(self, url, digest):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM segments WHERE url = ?", (url,))
+        try:
+            os.remove(self.object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def place(self, url, fd, offset, size):
+        # Writes the stored segment of the url at offset into fd, returns
+        # False if it is not stored or its size differs.
+        f = self.open(url)
+        if f is None:
+            return False
+        with f:
+            if f.tell() != size:
+                return False
+            f.seek(0)
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                utils.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+        return True
+
+    def put(self, digest, write):
+        # Creates the object by calling write with an open temporary file,
+        # unless it already exists.
+        fname = self.object_path(digest)
+        if exists(fname):
+            return fname
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fname))
+        try:
+            with os.fdopen(fd, "wb") as out:
+                write(out)
+            os.replace(tmp, fname)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return fname
+
+    def add(self, url, spool):
+        # Stores a fetched spool under its url, the spool stays usable.
+        digest = spool_digest(spool)
+        size = spool.tell()
+        self.put(digest, lambda out: utils.copy_spool(spool, out))
+        spool.seek(size)
+        self.index(url, digest, size)
+
+    def add_range(self, url, fd, offset, size):
+        # Stores the segment of the url written at offset into fd, as the
+        # preallocated downloads have it.
+        def chunks():
+            for pos in range(offset, offset + size, HASH_CHUNK):
+                chunk = utils.pread(fd, min(HASH_CHUNK, offset + size - pos),
+                                    pos)
+                if not chunk:
+                    raise IOError("Segment of {} is cut short.".format(url))
+                yield chunk
+
+        def write(out):
+            for chunk in chunks():
+                out.write(chunk)
+
+        digest = hashlib.sha256()
+        for chunk in chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        self.put(digest, write)
+        self.index(url, digest, size)
+
+    def index(self, url, digest, size):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO segments VALUES (?, ?, ?)",
+                            (url, digest, size))
+
+    def add_file(self, fname):
+        # Moves a finished output into the store and links it back in place,
+        # an identical output already stored is linked instead.
+        with open(fname, "rb") as f:
+            digest = file_digest(f)
+        target = self.object_path(digest)
+        if not exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(fname, target)
+                return
+            except OSError:
+                # Another filesystem, or someone stored it just now.
+                def copy(out):
+                    with open(fname, "rb") as f:
+                        shutil.copyfileobj(f, out, HASH_CHUNK)
+
+                self.put(digest, copy)
+        else:
+            vprint("[*] Output already stored: {}.".format(fname))
+        self.materialize(target, fname)
+
+    def materialize(self, target, fname):
+        # Replaces fname by a clone of the object, or a hard link to it, and
+        # leaves it alone if neither is possible.
+        tmp = fname + ".link"
+        if reflink(target, tmp):
+            os.replace(tmp, fname)
+            return
+        try:
+            os.link(target, tmp)
+        except OSError:
+            return
+        os.replace(tmp, fname)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def create_store(config):
+    path = getattr(config, "store", None)
+    return SegmentStore(path) if path else None
+
+
+def get_store():
+    # Returns the shared segment store, None if there is none.
+    return utils.get_runtime().part("store", create_store,
+                                    lambda store: store.close())
+
+
+def store_output(fname):
+    store = get_store()
+    if store is not None:
+        store.add_file(fname)
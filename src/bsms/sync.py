@@ -0,0 +1,112 @@
+import hashlib
+import json
+import re
+import threading
+from os import remove, replace
+from os.path import exists, getsize, join, relpath
+
+from utils import vprint
+
+MANIFEST_NAME = ".bsms-manifest.json"
+# Listing fields that change without the lecture changing, like signed
+# thumbnail urls or view counters.
+VOLATILE_KEY_RE = re.compile(r"Url|Thumbnail|View", re.IGNORECASE)
+
+
+def fingerprint(listing):
+    stable = {key: value for key, value in listing.items()
+              if not VOLATILE_KEY_RE.search(key)}
+    return hashlib.sha256(json.dumps(stable, sort_keys=True,
+                                     default=str).encode()).hexdigest()
+
+
+def file_hash(fname):
+    h = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class SyncManifest(object):
+    # Record of the lectures already mirrored into a course directory, with
+    # the listing fingerprint they were downloaded at and the files they
+    # produced.
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = join(directory, MANIFEST_NAME)
+        self.lock = threading.Lock()
+        if exists(self.path):
+            with open(self.path) as f:
+                self.lectures = json.load(f)
+        else:
+            self.lectures = {}
+
+    def is_current(self, lecture_id, lecture_fingerprint):
+        entry = self.lectures.get(lecture_id)
+        if entry is None or entry["fingerprint"] != lecture_fingerprint:
+            return False
+        # Entries without a stream count predate it, a lecture has at least
+        # one stream.
+        if len(entry["streams"]) < entry.get("stream_count", 1):
+            return False
+        for stream in entry["streams"]:
+            fname = join(self.directory, stream["file"])
+            if not exists(fname) or getsize(fname) != stream["size"]:
+                return False
+        return True
+
+    def changed(self, listing):
+        # Filters a (lecture_id, fingerprint, ...) listing down to the entries
+        # that need to be downloaded, as they come.
+        ids = set()
+        changed = 0
+        for entry in listing:
+            ids.add(entry[0])
+            if not self.is_current(entry[0], entry[1]):
+                changed += 1
+                yield entry
+        gone = [lecture_id for lecture_id in self.lectures
+                if lecture_id not in ids]
+        print("[*] Sync: {} new or changed, {} current, {} no longer "
+              "listed.".format(changed, len(ids) - changed, len(gone)))
+
+    def discard_files(self, lecture_id):
+        # Removes the files of a lecture that changed since it was mirrored,
+        # so that they are downloaded again instead of skipped as existing.
+        entry = self.lectures.get(lecture_id)
+        if entry is None:
+            return
+        for stream in entry["streams"]:
+            fname = join(self.directory, stream["file"])
+            if exists(fname):
+                vprint("[ ] Removing outdated {}.".format(fname))
+                remove(fname)
+
+    def record(self, lecture_id, lecture_fingerprint, files):
+        # Files of streams that failed have no name, they count towards the
+        # streams of the lecture but are not recorded.
+        streams = [{"file": relpath(fname, self.directory), "type": type,
+                    "size": getsize(fname), "sha256": file_hash(fname)}
+                   for fname, type in files if fname is not None]
+        with self.lock:
+            self.lectures[lecture_id] = {"fingerprint": lecture_fingerprint,
+                                         "streams": streams,
+                                         "stream_count": len(files)}
+            tmp_path = self.path + ".part"
+            with open(tmp_path, "w") as f:
+                json.dump(self.lectures, f, indent=2, sort_keys=True)
+            replace(tmp_path, self.path)
+
+
+def sync_lecture(manifest, lecture_id, lecture_fingerprint, download_lecture,
+                 lecture_url, output_name, session, dry_run=False):
+    files = []
+    if not dry_run:
+        manifest.discard_files(lecture_id)
+    if not download_lecture(lecture_url, output_name, session, files):
+        return False
+    if not dry_run:
+        vprint("[*] Recording {} in sync manifest.".format(lecture_id))
+        manifest.record(lecture_id, lecture_fingerprint, files)
+    return True
@@ -0,0 +1,236 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+try:
+    import aiohttp
+    from yarl import URL
+except ImportError:
+    aiohttp = None
+
+import utils
+from fetch import (FetchError, Latency, check_length, check_status,
+                   get_retries, get_timeout, record_fetch, retry_delay)
+from ratelimit import get_limiter, MAX_BACKOFFS
+from store import get_store
+
+
+class AsyncTransport(object):
+    # One event loop in a background thread shared by all lectures, so that
+    # keep-alive connections are pooled across the whole run.
+    def __init__(self, limit=100, limit_per_host=16):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       name="bsms-transport", daemon=True)
+        self.thread.start()
+        self.client = self.run(self._create_client(limit, limit_per_host))
+
+    async def _create_client(self, limit, limit_per_host):
+        connector = aiohttp.TCPConnector(limit=limit,
+                                         limit_per_host=limit_per_host)
+        return aiohttp.ClientSession(connector=connector,
+                                     cookie_jar=aiohttp.DummyCookieJar(),
+                                     auto_decompress=True)
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def fetch_once(self, session, url, params=None):
+        # Let requests build the url, headers and cookies, so the requests
+        # done here look exactly like the ones done through the session.
+        prepared = session.prepare_request(
+                utils.requests.Request("GET", url, params=params))
+        limiter = get_limiter()
+        timeout = aiohttp.ClientTimeout(sock_connect=get_timeout(),
+                                        sock_read=get_timeout())
+        for attempt in range(MAX_BACKOFFS + 1):
+            await asyncio.sleep(limiter.request_delay(url))
+            spool = utils.new_spool()
+            try:
+                async with self.client.get(URL(prepared.url, encoded=True),
+                                           headers=dict(prepared.headers),
+                                           timeout=timeout) as resp:
+                    delay = limiter.response(url, resp.status, resp.headers)
+                    if delay is None or attempt == MAX_BACKOFFS:
+                        check_status(resp.status)
+                        got = 0
+                        async for chunk in resp.content.iter_chunked(
+                                utils.CHUNK_SIZE):
+                            spool.write(chunk)
+                            got += len(chunk)
+                            await asyncio.sleep(limiter.read_delay(
+                                    len(chunk)))
+                        check_length(resp.headers, got)
+                        return spool
+            except BaseException:
+                spool.close()
+                raise
+            spool.close()
+            await asyncio.sleep(delay)
+
+    async def fetch_hedged(self, session, url, params, delay, stats=None):
+        # Sends a duplicate if the fetch is not done after delay, the first
+        # good response wins and the other is cancelled.
+        tasks = [asyncio.ensure_future(self.fetch_once(session, url, params))]
+        error = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                utils.vprint("[ ] Hedging slow fetch of {}.".format(url))
+                if stats is not None:
+                    stats.add("hedges")
+                tasks.append(asyncio.ensure_future(
+                        self.fetch_once(session, url, params)))
+            while tasks:
+                done, _ = await asyncio.wait(
+                        tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        for other in done:
+                            if other is not task and \
+                                    other.exception() is None:
+                                other.result().close()
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # Also when cancelled, wait for the fetches left so that none of
+            # them finishes unobserved.
+            for task in tasks:
+                task.cancel()
+            for result in await asyncio.gather(*tasks,
+                                               return_exceptions=True):
+                if not isinstance(result, BaseException):
+                    result.close()
+
+    async def fetch(self, session, url, params=None, latency=None,
+                    stats=None):
+        # Timeouts, validation, hedging, retries and the store as in
+        # fetch.fetch_segment.
+        store = get_store()
+        if store is not None:
+            # Opening checks the digest, off the loop.
+            stored = await self.loop.run_in_executor(None, store.open, url)
+            if stored is not None:
+                if stats is not None:
+                    stats.add("stored")
+                return stored
+        retries = get_retries()
+        for attempt in range(retries + 1):
+            start = time.monotonic()
+            delay = latency.hedge_delay() if latency is not None else None
+            try:
+                if delay is None:
+                    spool = await self.fetch_once(session, url, params)
+                else:
+                    spool = await self.fetch_hedged(session, url, params,
+                                                    delay, stats)
+            except (aiohttp.ClientError, asyncio.TimeoutError,
+                    FetchError) as e:
+                if attempt == retries:
+                    raise
+                if stats is not None:
+                    stats.add("retries")
+                wait_time = retry_delay(attempt)
+                utils.vprint("[!] Fetching {} failed: {} Retrying in {:.1f}s."
+                             .format(url, e, wait_time))
+                await asyncio.sleep(wait_time)
+                continue
+            record_fetch(spool, time.monotonic() - start, latency, stats)
+            if store is not None:
+                # Hashing and writing the object would hold up the loop.
+                await self.loop.run_in_executor(None, store.add, url, spool)
+            return spool
+
+    async def _download_tracks(self, session, tracks, concurrency, window,
+                               params):
+        semaphore = asyncio.Semaphore(concurrency)
+        track_size = utils.track_window(window, concurrency, tracks)
+        # Writes may block, for example on a pipe into ffmpeg that is still
+        # reading another track, so every track has a writer thread of its
+        # own instead of sharing the loop's default executor.
+        writers = ThreadPoolExecutor(max_workers=max(len(tracks), 1))
+
+        async def fetch_one(url, latency, stats):
+            async with semaphore:
+                return await self.fetch(session, url, params, latency, stats)
+
+        async def write_track(track):
+            # Sliding window, at most `track_size` segments are in flight or
+            # waiting in the reorder buffer for the ones before them.
+            latency = Latency()
+            urls = iter(track.urls)
+            pending = deque(asyncio.ensure_future(
+                                    fetch_one(url, latency, track.stats))
+                            for url in islice(urls, track_size))
+            index = track.first_index
+            write = None
+            try:
+                while pending:
+                    spool = await pending.popleft()
+                    for url in islice(urls, 1):
+                        pending.append(asyncio.ensure_future(
+                                fetch_one(url, latency, track.stats)))
+                    write = self.loop.run_in_executor(writers, track.write,
+                                                      spool, index)
+                    await asyncio.shield(write)
+                    write = None
+                    index += 1
+                await self.loop.run_in_executor(writers, track.done)
+            except BaseException:
+                # A write in progress goes on in its thread, the output is
+                # only closed once it is done.
+                if write is not None:
+                    await asyncio.wait([write])
+                await self.loop.run_in_executor(writers, track.abort)
+                raise
+            finally:
+                for task in pending:
+                    task.cancel()
+                for result in await asyncio.gather(*pending,
+                                                   return_exceptions=True):
+                    if not isinstance(result, BaseException):
+                        result.close()
+
+        tasks = [asyncio.ensure_future(write_track(track))
+                 for track in tracks]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Stop the other tracks and wait for them to let go of their
+            # outputs, before they are closed and the error is raised.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            writers.shutdown(wait=False)
+
+    def download_tracks(self, session, tracks, concurrency=64, window=64,
+                        params=None):
+        self.run(self._download_tracks(session, tracks, concurrency, window,
+                                       params))
+
+    def close(self):
+        if self.loop.is_running():
+            self.run(self.client.close())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def get_transport():
+    # Returns the shared async transport, or None if the thread engine should
+    # be used.
+    return utils.get_runtime().part("transport", create_transport,
+                                    lambda transport: transport.close())
+
+
+def create_transport(config):
+    if aiohttp is None or getattr(config, "engine", "async") != "async":
+        return None
+    return AsyncTransport(
+            limit=getattr(config, "connections", 100),
+            limit_per_host=getattr(config, "connections_per_host", 16))
@@ -1,11 +1,27 @@
-import asyncio
+from collections import deque
 from concurrent.futures.thread import ThreadPoolExecutor
+from itertools import islice
 from random import choice
+import atexit
+import hashlib
+import io
+import os
 import requests
+import shutil
+import stat
+import threading
+import tempfile
 from http import cookies
 from urllib.parse import urlparse, urlunparse
 
 config = None
+runtime = None
+_runtime_lock = threading.Lock()
+
+# Segment bodies are read in chunks of this size and kept in memory only up to
+# the spool size, larger ones spill to a temporary file.
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 1024 * 1024
 
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/68.0.3440.106 Safari/537.36",
@@ -19,6 +35,53 @@ USER_AGENTS = [
 ]
 
 
+class Runtime(object):
+    # The parts built from a configuration on first use and shared by all its
+    # downloads: the page cache, limiter, store, transport, metrics and pools.
+    # They are closed with the runtime, the last built first.
+    def __init__(self, config):
+        self.config = config
+        self.parts = {}
+        self.closers = []
+        self.lock = threading.RLock()
+
+    def part(self, name, create, close=None):
+        with self.lock:
+            if name not in self.parts:
+                part = create(self.config)
+                self.parts[name] = part
+                if part is not None and close is not None:
+                    self.closers.append(lambda: close(part))
+            return self.parts[name]
+
+    def close(self):
+        with self.lock:
+            closers, self.closers = self.closers, []
+            self.parts = {}
+        for close in reversed(closers):
+            close()
+
+
+def get_runtime():
+    # The runtime of the installed downloader, else one of the command line
+    # configuration, closed at exit.
+    global runtime
+    with _runtime_lock:
+        if runtime is None or runtime.config is not config:
+            runtime = Runtime(config)
+            atexit.register(runtime.close)
+        return runtime
+
+
+def install_runtime(new_runtime):
+    # Makes the configuration of the runtime the one of the download code,
+    # None uninstalls it.
+    global runtime, config
+    with _runtime_lock:
+        runtime = new_runtime
+        config = new_runtime.config if new_runtime is not None else None
+
+
 def get_user_agent():
     return {"User-Agent": choice(USER_AGENTS)}
 
@@ -29,37 +92,345 @@ def vprint(*args, **kwargs):
         print(*args, **kwargs)
 
 
+def parse_playlist(text):
+    import m3u8
+    return m3u8.loads(text)
+
+
 def get_url_root(url):
     parsed = urlparse(url)
     return urlunparse((parsed.scheme, parsed.netloc, "", "", "", ""))
 
 
-@asyncio.coroutine
-def write_segment(segment, out):
-    print(".", end="", flush=True)
-    out.write(segment.content)
+# Where there is no pwrite or pread, the seek and the write or read of a file
+# shared by threads must not interleave.
+_pwrite_lock = threading.Lock()
+
+
+def pwrite(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(fd, view, offset)
+        else:
+            with _pwrite_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+def pread(fd, size, offset):
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    with _pwrite_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+
+class Spool(object):
+    # A body kept in a buffer while it is small and spilled to a temporary
+    # file when it grows past max_size. Unlike tempfile.SpooledTemporaryFile
+    # it tells which of the two holds the body.
+    def __init__(self, max_size=SPOOL_SIZE):
+        self.max_size = max_size
+        self.buffer = io.BytesIO()
+        self.file = None
+
+    @property
+    def in_memory(self):
+        return self.file is None
+
+    def stream(self):
+        return self.buffer if self.file is None else self.file
+
+    def spill(self):
+        self.file = tempfile.TemporaryFile()
+        self.file.write(self.buffer.getbuffer())
+        self.file.seek(self.buffer.tell())
+        self.buffer.close()
+        self.buffer = None
+
+    def write(self, data):
+        written = self.stream().write(data)
+        if self.file is None and self.buffer.tell() > self.max_size:
+            self.spill()
+        return written
+
+    def read(self, size=-1):
+        return self.stream().read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.stream().seek(offset, whence)
+
+    def tell(self):
+        return self.stream().tell()
+
+    def fileno(self):
+        # Only a spilled body has a file, callers fall back on reading.
+        if self.file is None:
+            raise io.UnsupportedOperation("The spool is in memory.")
+        return self.file.fileno()
 
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        elif self.buffer is not None:
+            self.buffer.close()
 
-@asyncio.coroutine
-def process_segments(segment_futures, out):
-    for segment_future in segment_futures:
-        segment = yield from segment_future
-        yield from asyncio.Task(write_segment(segment, out))
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
-def download_segments(session, urls, out, max_workers=4):
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        loop = asyncio.get_event_loop()
-        futures = [loop.run_in_executor(executor, session.get, url)
-                   for url in urls]
-        loop.run_until_complete(process_segments(futures, out))
-        print()
+
+def new_spool():
+    return Spool()
+
+
+def copy_file_range(src, out, size):
+    # Lets the kernel copy a spilled spool into a regular output file.
+    # Returns False if that is not possible here.
+    if not hasattr(os, "copy_file_range"):
+        return False
+    copied = 0
+    try:
+        dst = out.fileno()
+        if not stat.S_ISREG(os.fstat(dst).st_mode):
+            return False
+        out.flush()
+        start = out.tell()
+        while copied < size:
+            done = os.copy_file_range(src.fileno(), dst, size - copied,
+                                      copied, start + copied)
+            if not done:
+                break
+            copied += done
+    except (OSError, AttributeError, io.UnsupportedOperation):
+        if copied:
+            raise
+        return False
+    out.seek(start + copied)
+    return True
+
+
+def copy_spool(spool, out):
+    # Bodies still in memory are written straight from their buffer, spilled
+    # ones are copied by the kernel where it can, so that the data does not
+    # pass through Python. Stored segments are plain files.
+    if getattr(spool, "in_memory", False):
+        with spool.buffer.getbuffer() as view:
+            out.write(view)
+        return
+    size = spool.tell()
+    if not copy_file_range(spool, out, size):
+        spool.seek(0)
+        shutil.copyfileobj(spool, out, CHUNK_SIZE)
+
+
+def write_segment(spool, out, journal=None, index=None):
+    # Only ask for the offset when journaling, the output may be a pipe.
+    offset = out.tell() if journal is not None else None
+    copy_spool(spool, out)
+    spool.close()
+    if journal is not None:
+        # The data has to be in the file before the journal says so.
+        out.flush()
+        journal.record(index, offset, out.tell() - offset)
+
+
+def ordered_map(executor, fn, items, window):
+    # Like executor.map, but with at most `window` items in flight or waiting
+    # in the reorder buffer for the ones before them to be consumed.
+    items = iter(items)
+    pending = deque(executor.submit(fn, item)
+                    for item in islice(items, max(window, 1)))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for item in islice(items, 1):
+                pending.append(executor.submit(fn, item))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class Track(object):
+    # Segment urls that are written in order into one output, optionally
+    # recording them in a journal, counting them in stats and closing the
+    # output once complete.
+    def __init__(self, urls, out, journal=None, first_index=0, close=False,
+                 stats=None):
+        self.urls = urls
+        self.out = out
+        self.journal = journal
+        self.first_index = first_index
+        self.close = close
+        self.stats = stats
+        if stats is not None:
+            stats.expect("segments", len(urls))
+
+    def write(self, spool, index):
+        write_segment(spool, self.out, self.journal, index)
+        if self.stats is not None:
+            self.stats.add("segments")
+
+    def done(self):
+        if self.close:
+            self.out.close()
+
+    def abort(self):
+        # Closes an output the track owns once it stopped early, so that the
+        # reader of a pipe sees its end instead of waiting for more.
+        if self.close:
+            try:
+                self.out.close()
+            except OSError:
+                pass
+
+
+def track_window(window, workers, tracks):
+    # Tracks get an equal share of the window, so that their segments are
+    # interleaved instead of the first track taking all workers.
+    return max(max(window, workers) // len(tracks), 1)
+
+
+def download_tracks_threaded(session, tracks, max_workers=4, window=16,
+                             params=None):
+    # All tracks share one pool of fetch threads, each is written by its own
+    # writer thread. Once a track fails the others stop at their next
+    # segment, the error of the failed one is raised.
+    from fetch import Latency, fetch_segment
+    track_size = track_window(window, max_workers, tracks)
+    failed = threading.Event()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            ThreadPoolExecutor(max_workers=len(tracks)) as writers:
+        def write_track(track):
+            latency = Latency()
+            spools = ordered_map(executor,
+                                 lambda url: fetch_segment(session, url,
+                                                           params, latency,
+                                                           track.stats),
+                                 track.urls, track_size)
+            try:
+                for index, spool in enumerate(spools, track.first_index):
+                    if failed.is_set():
+                        spool.close()
+                        track.abort()
+                        return
+                    track.write(spool, index)
+                track.done()
+            except BaseException:
+                failed.set()
+                track.abort()
+                raise
+            finally:
+                # Cancels the fetches not started yet.
+                spools.close()
+
+        futures = [writers.submit(write_track, track) for track in tracks]
+        for future in futures:
+            future.result()
+
+
+def download_tracks(session, tracks, max_workers=4, window=16, params=None):
+    # Use the shared asyncio transport if available, threads otherwise.
+    from transport import get_transport
+    transport = get_transport()
+    if transport is not None:
+        transport.download_tracks(session, tracks, concurrency=max_workers,
+                                  window=window, params=params)
+    else:
+        download_tracks_threaded(session, tracks, max_workers=max_workers,
+                                 window=window, params=params)
+
+
+def download_segments(session, urls, out, max_workers=4, window=16,
+                      params=None, journal=None, first_index=0, stats=None):
+    download_tracks(session, [Track(urls, out, journal, first_index,
+                                    stats=stats)],
+                    max_workers=max_workers, window=window, params=params)
 
 
 def create_session(initial_cookies=None):
     s = requests.Session()
+    # Tells apart the accounts of sessions sharing the page cache, the
+    # cookies the session gets later belong to the same account.
+    s.identity = hashlib.sha256(
+            (initial_cookies or "").encode()).hexdigest()
     if initial_cookies is not None:
         cookie = cookies.SimpleCookie()
         cookie.load(initial_cookies)
         s.cookies.update(cookie)
     return s
+
+
+def add_common_options(parser):
+    # The options of both platforms, shared by the command line tools and
+    # the library API.
+    from metrics import FORMATS
+    from ratelimit import parse_rate
+    parser.add_argument("-n", "--dry-run", dest="dry_run", action="store_true",
+                        help="Do not download anything.")
+    parser.add_argument("--plan", dest="plan", metavar="PLAN_FILE",
+                        help="Resolve the lectures concurrently and write a JSON plan of their segments, durations and sizes instead of downloading, a batch run downloads the plan without scraping.")
+    parser.add_argument("--plan-workers", dest="plan_workers", type=int,
+                        default=8,
+                        help="Number of lectures resolved and segment sizes asked for in parallel when planning.")
+    parser.add_argument("--sync", dest="sync", action="store_true",
+                        help="Only download new or changed lectures of a course, tracked in a manifest in the output directory.")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="store_true",
+                        help="Enable verbose output.")
+    parser.add_argument("--cache", dest="cache", metavar="CACHE_FILE",
+                        help="Cache scraped pages in this SQLite file.")
+    parser.add_argument("--cache-ttl", dest="cache_ttl", type=int, default=3600,
+                        help="Seconds a cached page is used before it is revalidated.")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                        help="Number of lectures to download in parallel.")
+    parser.add_argument("--max-lectures", dest="max_lectures", type=int,
+                        help="Maximum number of lectures downloaded at once across all courses of a batch or daemon.")
+    parser.add_argument("--quality", dest="quality",
+                        choices=["max-resolution", "max-bandwidth", "min"],
+                        default="max-resolution",
+                        help="Which variant of an adaptive stream to download.")
+    parser.add_argument("--max-bitrate", dest="max_bitrate", type=int,
+                        help="Only consider variants up to this many bits per second.")
+    parser.add_argument("--max-size", dest="max_size", type=float,
+                        help="Only consider variants estimated to fit into this many MiB per stream.")
+    parser.add_argument("--segment-workers", dest="segment_workers", type=int,
+                        default=4,
+                        help="Number of segments to download in parallel per lecture.")
+    parser.add_argument("--segment-window", dest="segment_window", type=int,
+                        default=16,
+                        help="Maximum number of segments in flight or buffered per lecture.")
+    parser.add_argument("--engine", dest="engine", choices=["async", "thread"],
+                        default="async",
+                        help="Segment download engine, async requires aiohttp and falls back to threads.")
+    parser.add_argument("--connections-per-host", dest="connections_per_host",
+                        type=int, default=16,
+                        help="Maximum number of pooled connections per host for the async engine.")
+    parser.add_argument("--max-rate", dest="max_rate", type=parse_rate,
+                        help="Bandwidth limit for all downloads together, in bytes per second (K, M and G suffixes allowed).")
+    parser.add_argument("--max-rps", dest="max_rps", type=float,
+                        help="Maximum number of requests per second to a single host.")
+    parser.add_argument("--preallocate", dest="preallocate", action="store_true",
+                        help="Ask for the segment sizes first and write segments straight into a preallocated file.")
+    parser.add_argument("--timeout", dest="timeout", type=float, default=30,
+                        help="Seconds to wait for a connection or for data before a request is retried.")
+    parser.add_argument("--retries", dest="retries", type=int, default=5,
+                        help="Number of times a failed segment request is retried.")
+    parser.add_argument("--hedge-factor", dest="hedge_factor", type=float,
+                        default=3.0,
+                        help="Send a duplicate request for a segment taking this many times the median segment time, 0 to disable.")
+    parser.add_argument("--metrics", dest="metrics", type=str,
+                        help="File to write download metrics to.")
+    parser.add_argument("--metrics-format", dest="metrics_format",
+                        choices=FORMATS, default="jsonl",
+                        help="Append JSON lines or keep a Prometheus text file up to date.")
+    parser.add_argument("--progress-interval", dest="progress_interval",
+                        type=float, default=1.0,
+                        help="Seconds between progress and metrics updates.")
+    parser.add_argument("--store", dest="store", metavar="STORE_DIR",
+                        help="Keep segments and outputs in a content addressed store, to skip fetching known segments and link duplicate outputs.")
@@ -0,0 +1,55 @@
+def bandwidth(variant):
+    return variant.stream_info.bandwidth or 0
+
+
+def resolution(variant):
+    return variant.stream_info.resolution or (0, 0)
+
+
+def playlist_duration(playlist):
+    return sum(segment.duration or 0 for segment in playlist.segments)
+
+
+def estimate_size(variant, duration):
+    return bandwidth(variant) * duration / 8
+
+
+def select_variant(variants, quality="max-resolution", max_bitrate=None,
+                   max_size=None, get_duration=None):
+    # Picks a variant of a master playlist. The bitrate cap and the size
+    # budget narrow down the candidates, falling back to the cheapest one if
+    # none fits, the quality policy then picks among them. The duration is
+    # only asked for when there is a size budget.
+    candidates = list(variants)
+    if max_bitrate is not None:
+        candidates = [variant for variant in candidates
+                      if bandwidth(variant) <= max_bitrate] or [
+                         min(candidates, key=bandwidth)]
+    if max_size is not None and get_duration is not None:
+        duration = get_duration()
+        candidates = [variant for variant in candidates
+                      if estimate_size(variant, duration) <= max_size] or [
+                         min(candidates, key=bandwidth)]
+    if quality == "max-bandwidth":
+        return max(candidates, key=bandwidth)
+    if quality == "min":
+        return min(candidates, key=lambda variant: (bandwidth(variant),
+                                                    resolution(variant)[0]))
+    return max(candidates, key=lambda variant: (resolution(variant)[0],
+                                                bandwidth(variant)))
+
+
+def select_media(media, variant):
+    # The rendition from the variant's group, preferring the default one.
+    groups = {variant.stream_info.audio, variant.stream_info.video}
+    matching = [item for item in media if item.group_id in groups] or list(
+            media)
+    defaults = [item for item in matching if item.default == "YES"]
+    return (defaults or matching)[0]
+
+
+def max_size_bytes(max_size):
+    # The size budget is given in MiB.
+    if max_size is None:
+        return None
+    return int(max_size * 1024 * 1024)